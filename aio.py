@@ -0,0 +1,135 @@
+from concurrent.futures import Executor, Future
+from limits import LimitExceeded, Limits
+from macro import MacroList
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import os
+import parse
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           422: "Unprocessable Content", 504: "Gateway Timeout"}
+
+
+def release(loop: asyncio.AbstractEventLoop, converter: "AsyncConverter"):
+    # called from the executor's thread once the work itself has ended
+    try:
+        loop.call_soon_threadsafe(converter.release)
+    except RuntimeError:
+        # the loop is already closed, nobody is left waiting for the slot
+        pass
+
+
+class AsyncConverter:
+    def __init__(self, cmd: MacroList, executor: Executor = None, limit: int = None, timeout: float = None, indent=True, depth=0, limits: Limits = None):
+        # rendering is CPU bound, a process pool keeps it off the event loop and its GIL
+        self.owned = executor is None
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+            # workers forked from a running loop would inherit its open client sockets
+            # and keep those connections from closing, the forkserver starts them clean
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None)
+            executor = ProcessPoolExecutor(mp_context=context)
+        self.executor = executor
+        self.cmd = cmd
+        self.limit = limit if limit else os.cpu_count()
+        self.slots = asyncio.Semaphore(self.limit)
+        self.timeout = timeout
+        self.indent = indent
+        self.depth = depth
+        # enforced inside the worker, which a timeout alone cannot stop
+        self.limits = limits
+        self.in_flight = 0
+        self.waiting = 0
+
+    def release(self):
+        self.in_flight -= 1
+        self.slots.release()
+
+    async def submit(self, timeout: float | None, fn, *args):
+        loop = asyncio.get_running_loop()
+        # the timeout covers waiting for a slot as well as the conversion
+        async with asyncio.timeout(self.timeout if timeout is None else timeout):
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            try:
+                future: Future = self.executor.submit(fn, *args)
+            except BaseException:
+                self.release()
+                raise
+            # a cancelled or timed out caller cannot stop a worker that already
+            # started, so the slot is only given back once the work has ended
+            future.add_done_callback(lambda _: release(loop, self))
+            return await asyncio.wrap_future(future)
+
+    async def convert(self, source: str, filename="<unknown>", timeout: float = None):
+        return await self.submit(timeout, parse.render_chunk, self.cmd, self.indent,
+                                 self.depth, source, filename, self.limits)
+
+    async def convert_file(self, filename: str, timeout: float = None):
+        return await self.submit(timeout, parse.convert, filename, False, self.cmd,
+                                 None, self.indent, self.depth, None, 1, self.limits)
+
+    async def convert_many(self, sources, timeout: float = None, return_exceptions=False):
+        return await asyncio.gather(*(self.convert(source, timeout=timeout) for source in sources),
+                                    return_exceptions=return_exceptions)
+
+    def close(self):
+        if self.owned:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        if self.owned:
+            # start every worker and import parse in it before the first real request
+            await self.convert_many(["_\n"] * self.limit)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+async def handle(converter: AsyncConverter, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        method, target, _ = (await reader.readline()).decode().split(" ", 2)
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        url = urlsplit(target)
+        if method != "POST" or url.path != "/convert":
+            status, out = 404, "not found\n"
+        else:
+            query = parse_qs(url.query)
+            try:
+                timeout = float(query["timeout"][0]) if "timeout" in query else None
+                status, out = 200, await converter.convert(body.decode(), timeout=timeout)
+            except TimeoutError:
+                status, out = 504, "conversion timed out\n"
+            except LimitExceeded as e:
+                status, out = 422, f"{e}\n"
+            except Exception as e:
+                status, out = 400, f"{type(e).__name__}: {e}\n"
+
+        data = out.encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                     "Content-Type: text/plain; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     "Connection: close\r\n\r\n".encode() + data)
+        await writer.drain()
+    except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(converter: AsyncConverter, host="127.0.0.1", port=0):
+    # POST /convert[?timeout=S] on an asyncio server, a stand-in for embedding the converter in a web app
+    return await asyncio.start_server(lambda reader, writer: handle(converter, reader, writer),
+                                      host, port, backlog=1024)
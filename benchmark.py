@@ -0,0 +1,715 @@
+from concurrent.futures import Executor, Future
+from limits import LimitExceeded, Limits
+import converter
+import parse
+import argparse
+import ast
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+OPERANDS = ("a", "b", "n", "i", "j", "x_max", "A[i]", "A[i + 1]", "node.left",
+            "2", "3.5", "True", "None", "foo(a, b)", "S.Pop()")
+OPERATORS = ("+", "-", "*", "/", "//", "%", "**")
+COMPARISONS = ("<", "<=", ">", ">=", "==", "!=")
+STRUCTURES = ("Array()", "Array((1, n))", "Array(B[1:n])", "Array((a, b), (c, d))",
+              "List()", "Mat((1, n), (1, m))", "SLL()", "DLL()", "Stack()", "Queue()",
+              "Deque()", "BST()", "Set()", "Map()", "MinHeap()", "MaxHeap()")
+
+DEFAULTS = {"functions": 20, "body": 10, "depth": 3,
+            "elifs": 10, "expr": 6, "structures": 4}
+DIMENSIONS = tuple(DEFAULTS)
+CASES = ("convert", "unindented", "unmemoized", "parallel", "streamed", "main")
+# the cases of the match statement parse() dispatched through before the EXPRESSIONS table
+LADDER = (ast.Constant, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Expr,
+          ast.BinOp, ast.BoolOp, ast.UnaryOp, ast.Attribute, ast.Name, ast.Subscript,
+          ast.FunctionDef, ast.Return, ast.Call, ast.If, ast.IfExp, ast.While, ast.For,
+          ast.Continue, ast.Break, ast.Pass, ast.Compare, ast.Assign, ast.AugAssign,
+          ast.Tuple, ast.List)
+
+
+def expression(rng: random.Random, size: int):
+    out = rng.choice(OPERANDS)
+    for _ in range(size - 1):
+        out += f" {rng.choice(OPERATORS)} {rng.choice(OPERANDS)}"
+    return out
+
+
+def condition(rng: random.Random, size: int):
+    return f"{expression(rng, max(1, size // 2))} {rng.choice(COMPARISONS)} {expression(rng, max(1, size // 2))}"
+
+
+def block(rng: random.Random, lines: list[str], level: int, depth: int, params: dict):
+    pad = "    " * level
+    for i in range(params["body"]):
+        lines.append(f"{pad}v{i} = {expression(rng, params['expr'])}")
+    if depth == 0:
+        return
+    match depth % 3:
+        case 0:
+            lines.append(f"{pad}while {condition(rng, params['expr'])}:")
+        case 1:
+            lines.append(f"{pad}for k{depth} in range(1, n, 2):")
+        case 2:
+            lines.append(f"{pad}if {condition(rng, params['expr'])}:")
+    block(rng, lines, level + 1, depth - 1, params)
+
+
+def generate(params: dict, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for f in range(params["functions"]):
+        lines.append(f"def generated_function_{f}(A: Array(), B: Array((1, n)), n):")
+        for s in range(params["structures"]):
+            lines.append(f"    D{s} = {STRUCTURES[(f + s) % len(STRUCTURES)]}")
+        block(rng, lines, 1, params["depth"], params)
+        if params["elifs"]:
+            lines.append("    if state == 0:")
+            lines.append(f"        state = {expression(rng, params['expr'])}")
+            for i in range(1, params["elifs"]):
+                lines.append(f"    elif state == {i}:")
+                lines.append(f"        state = {expression(rng, params['expr'])}")
+            lines.append("    else:")
+            lines.append("        return None")
+        lines.append(f"    return {expression(rng, params['expr'])}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def best_time(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_main(argv: list[str]):
+    saved = sys.argv
+    sys.argv = ["converter.py"] + argv
+    try:
+        converter.main()
+    finally:
+        sys.argv = saved
+
+
+def benchmark(params: dict, repeat: int, seed=0):
+    source = generate(params, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "generated.py")
+        output = os.path.join(directory, "generated.tex")
+        with open(path, "w") as f:
+            f.write(source)
+        memoized = parse.Converter(converter.MACROS)
+        rendered = memoized.convert(source)
+
+        def streamed():
+            with open(os.devnull, "w") as sink:
+                parse.stream_file(path, False, converter.MACROS, sink)
+
+        cases = {
+            "convert": lambda: parse.convert(path, False, converter.MACROS),
+            "unindented": lambda: parse.convert(path, False, converter.MACROS, indent=False),
+            "unmemoized": lambda: parse.Converter(converter.MACROS, memo_size=0).convert(source),
+            "parallel": lambda: parse.convert(path, False, converter.MACROS, jobs=None),
+            "streamed": streamed,
+            "main": lambda: run_main(["-f", path, "-o", output]),
+        }
+        results = {"input_bytes": len(source.encode()),
+                   "output_bytes": len(rendered.encode()),
+                   "memo": dict(zip(("hits", "misses", "entries"), memoized.memo.stats())),
+                   "memo_identical": parse.Converter(converter.MACROS, memo_size=0).convert(source) == rendered}
+        for name, fn in cases.items():
+            results[name] = {"seconds": best_time(fn, repeat),
+                             "peak_bytes": peak_memory(fn)}
+    return results
+
+
+def print_results(params: dict, results: dict):
+    print(", ".join(f"{k}={v}" for k, v in params.items()),
+          f"-> {results['input_bytes']} B in, {results['output_bytes']} B out")
+    memo = results["memo"]
+    print(f"  memo {memo['hits'] / (memo['hits'] + memo['misses']):.1%} hit rate, {memo['entries']} entries, "
+          f"output {'identical' if results['memo_identical'] else 'DIFFERS'} without it")
+    for name in CASES:
+        r = results[name]
+        print(f"  {name:<10} {r['seconds'] * 1000:10.2f} ms {r['peak_bytes'] / 2**20:10.2f} MiB peak")
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for name in CASES:
+        if name not in baseline["results"]:
+            continue
+        old, new = baseline["results"][name]["seconds"], results[name]["seconds"]
+        change = new / old - 1
+        print(f"  {name:<10} {old * 1000:10.2f} ms -> {new * 1000:10.2f} ms ({change:+.0%})")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def scaling(params: dict, repeat: int, max_ratio: float, seed=0):
+    failures = []
+    for dimension in DIMENSIONS:
+        if params[dimension] == 0:
+            continue
+        print(f"doubling {dimension}")
+        previous = None
+        for factor in (1, 2, 4):
+            scaled = dict(params)
+            scaled[dimension] = params[dimension] * factor
+            results = benchmark(scaled, repeat, seed)
+            line = f"  {dimension}={scaled[dimension]:<6} {results['input_bytes']:>10} B"
+            for name in CASES:
+                line += f"  {name} {results[name]['seconds'] * 1000:9.2f} ms"
+                if previous:
+                    growth = results["input_bytes"] / previous["input_bytes"]
+                    ratio = results[name]["seconds"] / \
+                        previous[name]["seconds"] / growth
+                    line += f" (x{ratio:.2f})"
+                    if ratio > max_ratio:
+                        failures.append(
+                            f"{name} grew x{ratio:.2f} faster than its input when doubling {dimension} to {scaled[dimension]}")
+            print(line)
+            previous = results
+    return failures
+
+
+def startup(repeat: int, target: float):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "converter.py")
+
+    def cold(argv: list[str]):
+        return best_time(lambda: subprocess.run([sys.executable] + argv, check=True,
+                                                stdout=subprocess.DEVNULL), repeat)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "generated.py")
+        with open(path, "w") as f:
+            f.write(generate(dict(DEFAULTS, functions=1)))
+        bare = cold(["-c", "pass"])
+        print(f"  {'interpreter':<12} {bare * 1000:8.1f} ms")
+        for name, argv in (("-p", [script, "-p"]),
+                           ("-o", [script, "-f", path, "-o", os.path.join(directory, "generated.tex")])):
+            overhead = cold(argv) - bare
+            print(f"  {name:<12} {overhead * 1000:+8.1f} ms over the interpreter")
+            if overhead * 1000 > target:
+                failures.append(
+                    f"{name} startup took {overhead * 1000:.1f} ms over the interpreter, target is {target:.0f} ms")
+    return failures
+
+
+def macro_calls(repeat: int, number=200000):
+    macros = converter.MACROS
+    calls = (("var", ("x_max",)), ("num", ("42",)), ("true", ()), ("cNull", ()),
+             ("for", ("i", "n")), ("forinc", ("i", "n", "2")), ("scope", ("body",)))
+    for name, args in calls:
+        macro = next(m for m in macros if m.full_name == name)
+        seconds = best_time(lambda: [macro(*args) for _ in range(number)], repeat)
+        print(f"  {name:<10} {number / seconds / 1e6:8.2f} M calls/s")
+
+
+class InlineExecutor(Executor):
+    # runs conversions on the event loop's thread, like calling parse.convert from a coroutine
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def percentiles(values: list[float]):
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+            for p in (0.5, 0.99, 1.0)]
+
+
+async def load_run(executor: Executor | None, sources: list[str], expected: list[str], requests: int, limit: int | None):
+    import aio
+    loop = asyncio.get_running_loop()
+    lags = []
+
+    async def probe(interval=0.005):
+        # how late the loop wakes up a coroutine that sleeps for interval
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lags.append(loop.time() - start - interval)
+
+    async def request(i: int, port: int):
+        # every tenth request gets a timeout too short to finish in
+        path = "/convert?timeout=0.001" if i % 10 == 9 else "/convert"
+        data = sources[i % len(sources)].encode()
+        start = loop.time()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"POST {path} HTTP/1.1\r\nHost: localhost\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        body = await reader.readexactly(length)
+        writer.close()
+        return status, status != 200 or body.decode() == expected[i % len(sources)], loop.time() - start
+
+    async with aio.AsyncConverter(converter.MACROS, executor, limit) as async_converter:
+        server = await aio.serve(async_converter)
+        port = server.sockets[0].getsockname()[1]
+        prober = asyncio.create_task(probe())
+        start = loop.time()
+        results = await asyncio.gather(*(request(i, port) for i in range(requests)))
+        wall = loop.time() - start
+
+        # cancel every other direct conversion, their slots must still come back
+        tasks = [asyncio.create_task(async_converter.convert(source))
+                 for source in sources * 4]
+        await asyncio.sleep(0)
+        for task in tasks[::2]:
+            task.cancel()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+        cancelled = sum(isinstance(r, asyncio.CancelledError) for r in done)
+        for _ in range(1000):
+            if not async_converter.in_flight:
+                break
+            await asyncio.sleep(0.01)
+
+        prober.cancel()
+        server.close()
+        await server.wait_closed()
+        return {"seconds": wall,
+                "statuses": [status for status, _, _ in results],
+                "wrong": sum(not ok for _, ok, _ in results),
+                "latency": percentiles([seconds for _, _, seconds in results]),
+                "lag": percentiles(lags),
+                "cancelled": cancelled,
+                "leaked_slots": async_converter.in_flight}
+
+
+def load(requests: int, limit: int | None, max_lag: float, seed=0):
+    sources = [generate(dict(DEFAULTS, functions=functions), seed)
+               for functions in (1, 2, 4, 8)]
+    expected = [parse.Converter(converter.MACROS).convert(source)
+                for source in sources]
+    failures = []
+    for name, executor in (("executor", None), ("blocking", InlineExecutor())):
+        r = asyncio.run(load_run(executor, sources, expected,
+                                 requests, limit))
+        statuses = r["statuses"]
+        ok, timed_out = statuses.count(200), statuses.count(504)
+        print(f"  {name:<10} {requests} requests in {r['seconds']:.2f} s: {ok} ok, {timed_out} timed out, "
+              f"{len(statuses) - ok - timed_out} failed, {r['wrong']} wrong")
+        print(f"  {'':<10} latency p50 {r['latency'][0]:.1f} ms, p99 {r['latency'][1]:.1f} ms; "
+              f"loop lag p50 {r['lag'][0]:.1f} ms, p99 {r['lag'][1]:.1f} ms, max {r['lag'][2]:.1f} ms; "
+              f"{r['cancelled']} cancelled, {r['leaked_slots']} slots leaked")
+        if r["wrong"] or len(statuses) - ok - timed_out or r["leaked_slots"]:
+            failures.append(f"{name} run had wrong, failed or leaked conversions")
+        if executor is None and r["lag"][1] > max_lag:
+            failures.append(
+                f"event loop lag p99 was {r['lag'][1]:.1f} ms with the executor, target is {max_lag:.0f} ms")
+    return failures
+
+
+def typesetting(text: str):
+    # math runs and color groups LaTeX sets up for text, counting those the
+    # macros it calls set up in their definitions
+    macros = {mac.full_name: mac.body for mac in converter.MACROS
+              if type(mac) == converter.Command}
+    costs = {}
+
+    def cost(name: str):
+        if name not in costs:
+            body = macros[name]
+            math, color = body.count("$") // 2, body.count(r"\textcolor")
+            for inner in re.findall(r"\\([A-Za-z]+)", body):
+                if inner in macros and inner != name:
+                    math, color = math + cost(inner)[0], color + cost(inner)[1]
+            costs[name] = math, color
+        return costs[name]
+    math, color = text.count("$") // 2, 0
+    for name in re.findall(r"\\([A-Za-z]+)", text):
+        if name in macros:
+            math, color = math + cost(name)[0], color + cost(name)[1]
+    return math, color
+
+
+def pdflatex_time(document: str, repeat: int):
+    # None without a TeX installation
+    if not shutil.which("pdflatex"):
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document.tex")
+        with open(path, "w") as f:
+            f.write(document)
+        return best_time(lambda: subprocess.run(["pdflatex", "-interaction=batchmode", "-draftmode", path],
+                                                cwd=directory, check=True, stdout=subprocess.DEVNULL), repeat)
+
+
+def compact(params: dict, repeat: int, seed=0):
+    source = generate(params, seed)
+    plain = converter.convert_source(source, depth=1)
+    seconds = best_time(lambda: converter.compactor()(plain), repeat)
+    compacted = converter.compactor()(plain)
+    for name, body in (("plain", plain), ("compact", compacted)):
+        math, color = typesetting(body)
+        compile_time = pdflatex_time(converter.document(body, converter.THEMES[2]), repeat)
+        print(f"  {name:<8} {len(body):>9} B  {math:>7} math runs  {color:>7} color groups  "
+              + ("pdflatex not found" if compile_time is None else f"pdflatex {compile_time * 1000:.0f} ms"))
+    print(f"  compacted in {seconds * 1000:.2f} ms")
+
+
+def ladder_converter():
+    # parse.Converter with parse() as the match statement it replaced
+    namespace = {"ast": ast}
+    lines = ["def parse(self, node):", "    match type(node):"]
+    for i, node_type in enumerate(LADDER):
+        handler = parse.EXPRESSIONS.get(node_type)
+        namespace[f"handler_{i}"] = handler if handler else lambda self, node: ""
+        lines += [f"        case ast.{node_type.__name__}:", f"            return handler_{i}(self, node)"]
+    lines.append("    return \"\"")
+    exec("\n".join(lines), namespace)
+    return type("LadderConverter", (parse.Converter,), {"parse": namespace["parse"]})
+
+
+def dispatch(params: dict, repeat: int, seed=0):
+    # expression heavy functions, unmemoized so every node is dispatched
+    params = dict(params, body=max(params["body"], 50), expr=max(params["expr"], 12))
+    tree = ast.parse(generate(params, seed))
+    nodes = sum(1 for _ in ast.walk(tree))
+    failures = []
+    rendered = {}
+    for name, cls in (("match", ladder_converter()), ("table", parse.Converter)):
+        def run():
+            renderer = cls(converter.MACROS, memo_size=0)
+            return "".join(renderer.render(node) for node in tree.body)
+        rendered[name] = run()
+        seconds = best_time(run, repeat)
+        print(f"  {name:<6} {nodes / seconds / 1e3:9.1f} k nodes/s  ({nodes} nodes in {seconds * 1000:.1f} ms)")
+    if rendered["match"] != rendered["table"]:
+        failures.append("table dispatch renders differently from match dispatch")
+    return failures
+
+
+def threads(params: dict, count: int, repeat: int, seed=0):
+    # different files converted at once on count threads, each run checked
+    # against the serial output
+    from concurrent.futures import ThreadPoolExecutor
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(count * 4):
+            paths.append(os.path.join(directory, f"generated_{i}.py"))
+            with open(paths[-1], "w") as f:
+                f.write(generate(params, seed + i))
+        serial = [parse.convert(path, False, converter.MACROS) for path in paths]
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            def threaded():
+                return list(pool.map(lambda path: parse.convert(path, False, converter.MACROS), paths))
+            for run in range(max(repeat, 3)):
+                outs = threaded()
+                mismatched = sum(out != expected for out, expected in zip(outs, serial))
+                if mismatched:
+                    failures.append(f"{mismatched}/{len(paths)} threaded outputs differ from serial in run {run + 1}")
+            serial_seconds = best_time(lambda: [parse.convert(path, False, converter.MACROS)
+                                                for path in paths], repeat)
+            threaded_seconds = best_time(threaded, repeat)
+    gil = "GIL" if getattr(sys, "_is_gil_enabled", lambda: True)() else "free-threaded"
+    print(f"  {len(paths)} files, {os.cpu_count()} cores, {gil}")
+    print(f"  serial     {len(paths) / serial_seconds:8.1f} files/s")
+    print(f"  {count:>2} threads {len(paths) / threaded_seconds:8.1f} files/s")
+    return failures
+
+
+def elif_chain(branches: int):
+    # if state == 0 ... elif state == branches - 1 ... else, built bottom up
+    # since ast.parse itself recurses once per elif
+    orelse = [ast.Return(ast.Constant(None))]
+    for i in reversed(range(branches)):
+        orelse = [ast.If(ast.Compare(ast.Name("state"), [ast.Eq()], [ast.Constant(i)]),
+                         [ast.Assign([ast.Name("state")], ast.Constant(i + 1))], orelse)]
+    return ast.FunctionDef("chain", ast.arguments(args=[ast.arg("state")]), orelse)
+
+
+def nested_loops(depth: int):
+    body = [ast.Assign([ast.Name("x")], ast.Constant(1))]
+    for _ in range(depth):
+        body = [ast.While(ast.Name("a"), body)]
+    return ast.FunctionDef("nested", ast.arguments(args=[ast.arg("a")]), body)
+
+
+def deep(branches: int, depth: int, recursion_limit: int):
+    # rendered under a recursion limit far below either size, so any
+    # recursion per branch or level fails
+    failures = []
+    cases = (("elif chain", elif_chain(branches), 2 * branches + 2, r"\cElif", branches - 1),
+             ("nesting", nested_loops(depth), depth + 1, r"\while", depth))
+    for name, tree, rows, macro, count in cases:
+        renderer = parse.Converter(converter.MACROS, indent=False)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(recursion_limit)
+        try:
+            start = time.perf_counter()
+            out = renderer.render(tree)
+            seconds = time.perf_counter() - start
+        except RecursionError:
+            failures.append(f"{name} hit the recursion limit of {recursion_limit}")
+            continue
+        finally:
+            sys.setrecursionlimit(limit)
+        numbered = out.split(r"\begin{tabular}{@{}r}")[1].split(r"\end{tabular}")[0].count(r"\\")
+        print(f"  {name:<10} {seconds * 1000:8.1f} ms  {numbered} rows")
+        if numbered != rows:
+            failures.append(f"{name} numbered {numbered} rows, expected {rows}")
+        if out.count(macro) != count:
+            failures.append(f"{name} rendered {out.count(macro)} {macro}, expected {count}")
+    return failures
+
+
+def adversarial_sources():
+    # nesting that recurses while parsing or rendering, and inputs too large
+    # for the default limits
+    def body(expr: str):
+        return f"def f(a, b):\n    x = {expr}\n"
+    return {"parentheses": body("(" * 50000 + "a" + ")" * 50000),
+            "unary": body("-" * 50000 + "a"),
+            "sum": body(" + ".join(["a"] * 50000)),
+            "power tower": body(" ** ".join(["a"] * 5000)),
+            "attributes": body("a" + ".b" * 5000),
+            "calls": body("f(" * 5000 + "a" + ")" * 5000),
+            "not": body("not " * 5000 + "a"),
+            "conditional": body("a if b else " * 2000 + "c"),
+            "subscripts": body("a" + "[i]" * 5000),
+            "large Array": body("Array((" + ", ".join(["a"] * 400000) + "), (c, d))"),
+            "large source": "x = 1\n" * 200000}
+
+
+def adversarial(params: dict, repeat: int, max_seconds: float, max_overhead: float, seed=0):
+    failures = []
+    limits = Limits()
+    for name, source in adversarial_sources().items():
+        start = time.perf_counter()
+        try:
+            converter.convert_source(source, limits=limits)
+            result = "converted"
+        except (LimitExceeded, SyntaxError) as e:
+            result = f"{type(e).__name__}: {e}"
+        except BaseException as e:
+            result = f"{type(e).__name__}: {e}"
+            failures.append(f"{name} raised {type(e).__name__} instead of a limit error")
+        seconds = time.perf_counter() - start
+        print(f"  {name:<14} {seconds * 1000:8.1f} ms  {result}")
+        if result == "converted":
+            failures.append(f"{name} converted under the default limits")
+        if seconds > max_seconds:
+            failures.append(
+                f"{name} took {seconds:.2f} s to be rejected, target is {max_seconds:.2f} s")
+
+    # limits the sources above stay under
+    for limit, tight in (("nodes", Limits(nodes=1000)), ("output_size", Limits(output_size=1000)),
+                         ("seconds", Limits(seconds=0.01))):
+        try:
+            converter.convert_source(generate(params, seed), limits=tight)
+            failures.append(f"the {limit} limit was not enforced")
+        except LimitExceeded as e:
+            print(f"  {limit:<14} {e}")
+
+    source = generate(params, seed)
+    # cached blocks reach the sink without rendering, on a miss and on a hit
+    from cache import RenderCache
+    size = len(parse.Converter(converter.MACROS).convert(source))
+    with tempfile.TemporaryDirectory() as directory:
+        cache = RenderCache(directory, converter.MACROS)
+        for run in ("miss", "hit"):
+            try:
+                parse.new_converter(converter.MACROS, cache=cache, limits=Limits(output_size=size // 2)).convert(source)
+                failures.append(f"the output_size limit was not enforced on a cache {run}")
+            except LimitExceeded as e:
+                print(f"  cache {run:<8} {e}")
+        cache = RenderCache(os.path.join(directory, "fits"), converter.MACROS)
+        for run in ("miss", "hit"):
+            try:
+                parse.new_converter(converter.MACROS, cache=cache, limits=Limits(output_size=size)).convert(source)
+            except LimitExceeded as e:
+                failures.append(f"a cache {run} exceeded an output_size limit the output fits: {e}")
+
+    if converter.convert_source(source) != converter.convert_source(source, limits=limits):
+        failures.append("output differs under the default limits")
+    plain = best_time(lambda: converter.convert_source(source), repeat)
+    limited = best_time(lambda: converter.convert_source(source, limits=limits), repeat)
+    overhead = limited / plain - 1
+    print(f"  {len(source)} B source: {plain * 1000:.2f} ms, {limited * 1000:.2f} ms "
+          f"under the default limits ({overhead:+.0%})")
+    if overhead > max_overhead:
+        failures.append(f"the limits cost {overhead:.0%}, target is {max_overhead:.0%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks parse.convert with and without indentation and converter.main on generated sources")
+    for dimension, default in DEFAULTS.items():
+        parser.add_argument(f"--{dimension}", type=int, default=default,
+                            help=f"Generator parameter. {default} if omitted")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Timed runs per case, the best is kept. 3 if omitted")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the source generator. 0 if omitted")
+    parser.add_argument("--save", metavar="FILE",
+                        help="Writes the results to a JSON baseline")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="Compares the results against a JSON baseline, failing on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against --baseline. 0.2 if omitted")
+    parser.add_argument("--scaling", action="store_true",
+                        help="Doubles each generator parameter in turn, failing if a case grows worse than linearly with input size")
+    parser.add_argument("--max-ratio", type=float, default=1.5,
+                        help="Allowed growth of time per input byte on each doubling for --scaling. 1.5 if omitted")
+    parser.add_argument("--startup", action="store_true",
+                        help="Measures cold-start time of converter.py -p and -o runs, failing past --startup-target")
+    parser.add_argument("--startup-target", type=float, default=40.0, metavar="MS",
+                        help="Allowed cold-start time over a bare interpreter for --startup. 40 if omitted")
+    parser.add_argument("--macros", action="store_true",
+                        help="Measures calls per second of the macro templates parse.py calls for every token")
+    parser.add_argument("--load", type=int, metavar="N",
+                        help="Sends N concurrent requests to an asyncio stand-in server using aio.AsyncConverter, "
+                        "once with a process pool and once blocking the loop, and measures event loop lag")
+    parser.add_argument("--limit", type=int,
+                        help="In-flight conversions allowed by --load. Number of cores if omitted")
+    parser.add_argument("--max-lag", type=float, default=20.0, metavar="MS",
+                        help="Allowed 99th percentile event loop lag of --load with the process pool. 20 if omitted")
+    parser.add_argument("--adversarial", action="store_true",
+                        help="Converts pathologically nested and oversized sources under the default limits, "
+                        "failing unless each is rejected in time, and measures the limits' overhead on the generated source")
+    parser.add_argument("--reject-seconds", type=float, default=1.0, metavar="SECONDS",
+                        help="Allowed time to reject an --adversarial source. 1 if omitted")
+    parser.add_argument("--max-overhead", type=float, default=0.3,
+                        help="Allowed slowdown of --adversarial's generated source under the default limits. 0.3 if omitted")
+    parser.add_argument("--compact", action="store_true",
+                        help="Compares bytes, math runs, color groups and pdflatex time of the generated source's output with and without --compact")
+    parser.add_argument("--dispatch", action="store_true",
+                        help="Measures nodes per second of parse.Converter's EXPRESSIONS table against the match statement it replaced, "
+                        "on expression heavy generated functions")
+    parser.add_argument("--threads", type=int, metavar="N",
+                        help="Converts different generated files on N threads at once, failing unless each output matches a serial run, "
+                        "and measures files per second of both")
+    parser.add_argument("--deep", action="store_true",
+                        help="Renders an elif chain of --branches and loops nested --nesting deep, built as ASTs, "
+                        "under a low recursion limit, failing on RecursionError or a miscounted output")
+    parser.add_argument("--branches", type=int, default=10000,
+                        help="Branches of the --deep elif chain. 10000 if omitted")
+    parser.add_argument("--nesting", type=int, default=10000,
+                        help="Loop nesting depth of --deep. 10000 if omitted")
+    parser.add_argument("--recursion-limit", type=int, default=100,
+                        help="Recursion limit --deep renders under. 100 if omitted")
+    parser.add_argument("--write-source", metavar="FILE",
+                        help="Writes the generated source to FILE and exits")
+    args = parser.parse_args()
+    params = {dimension: getattr(args, dimension) for dimension in DIMENSIONS}
+
+    if args.write_source:
+        with open(args.write_source, "w") as f:
+            f.write(generate(params, args.seed))
+        return 0
+
+    if args.macros:
+        macro_calls(args.repeat)
+        return 0
+
+    if args.load:
+        failures = load(args.load, args.limit, args.max_lag, args.seed)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    if args.compact:
+        compact(params, args.repeat, args.seed)
+        return 0
+
+    if args.deep:
+        failures = deep(args.branches, args.nesting, args.recursion_limit)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    if args.threads:
+        failures = threads(params, args.threads, args.repeat, args.seed)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    if args.dispatch:
+        failures = dispatch(params, args.repeat, args.seed)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    if args.adversarial:
+        failures = adversarial(params, args.repeat, args.reject_seconds,
+                               args.max_overhead, args.seed)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    if args.scaling or args.startup:
+        failures = []
+        if args.scaling:
+            failures += scaling(params, args.repeat,
+                                args.max_ratio, args.seed)
+        if args.startup:
+            failures += startup(max(args.repeat, 10), args.startup_target)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    results = benchmark(params, args.repeat, args.seed)
+    print_results(params, results)
+
+    status = 0
+    if not results["memo_identical"]:
+        print("FAIL: memoized output differs from unmemoized output", file=sys.stderr)
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print("baseline was recorded with different generator parameters",
+                  file=sys.stderr)
+            return 1
+        for name in compare(results, baseline, args.tolerance):
+            print(f"FAIL: {name} regressed by more than {args.tolerance:.0%}",
+                  file=sys.stderr)
+            status = 1
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"params": params, "python": platform.python_version(),
+                       "results": results}, f, indent=4)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from macro import MacroList
+import ast
+import hashlib
+import os
+import parse
+import macro
+
+
+def tool_version():
+    digest = hashlib.sha256()
+    for module in (parse, macro):
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    def __init__(self, directory: str, cmd: MacroList, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.salt = (tool_version() + str(cmd)).encode()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        entries = [(e.stat().st_atime_ns, e.name[:-4], e.stat().st_size)
+                   for e in os.scandir(directory) if e.name.endswith(".tex")]
+        self.entries = OrderedDict((key, size)
+                                   for _, key, size in sorted(entries))
+        self.size = sum(self.entries.values())
+        # a cap smaller than the last run's, or a run of only hits, still trims
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def key(self, node: ast.AST, variant=""):
+        digest = hashlib.sha256(self.salt + variant.encode())
+        digest.update(parse.fingerprint(node).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str):
+        return os.path.join(self.directory, key + ".tex")
+
+    def get(self, key: str):
+        if key not in self.entries:
+            return None
+        try:
+            with open(self.path(key)) as f:
+                out = f.read()
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            self.size -= self.entries.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return out
+
+    def put(self, key: str, out: str):
+        tmp = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(out)
+        os.replace(tmp, self.path(key))
+        self.size += len(out.encode()) - self.entries.pop(key, 0)
+        self.entries[key] = len(out.encode())
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        while self.entries and self.size > self.max_bytes * 0.9:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def render(self, converter: "parse.Converter", node: ast.stmt):
+        key = self.key(node, f"{converter.indent}:{converter.depth}")
+        out = self.get(key)
+        if out is not None:
+            self.hits += 1
+            return out
+        self.misses += 1
+        out = converter.render(node)
+        self.put(key, out)
+        return out
+
+    def stats(self):
+        return self.hits, self.misses, self.evictions
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return f"cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), " \
+            f"{self.evictions} evictions, {len(self.entries)} entries, {self.size / 2**20:.1f} MiB"
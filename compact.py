@@ -0,0 +1,137 @@
+from macro import Command, MacroList
+from typing import TextIO
+import re
+
+# math fragments TeX sets as Ord, Open or Close atoms, which get no space
+# next to one another. Any other fragment is braced into an Ord when merged
+ORDINARY = {r"\lfloor", r"\rfloor", r"\lceil", r"\rceil", "/", r"\%"}
+TEXT_SCRIPT = re.compile(r"\\text\{")
+SIGNIFICANT = re.compile(r"\\.|[${}]", re.S)
+
+
+def pieces(line: str):
+    # the line as text and ("$", fragment) pieces. The $ of \text{...} inside
+    # a run belong to the run
+    out = []
+    text_start = 0
+    start = None
+    for found in SIGNIFICANT.finditer(line):
+        char = found[0]
+        if start is None:
+            if char == "$":
+                if text_start < found.start():
+                    out.append(line[text_start:found.start()])
+                start, depth = found.start(), 0
+            continue
+        match char:
+            case "{":
+                depth += 1
+            case "}":
+                depth -= 1
+            case "$" if depth == 0:
+                out.append(("$", line[start + 1:found.start()]))
+                start = None
+                text_start = found.end()
+    if start is not None:
+        text_start = start
+    if text_start < len(line):
+        out.append(line[text_start:])
+    return out
+
+
+def ordinary(fragment: str):
+    return fragment in ORDINARY or TEXT_SCRIPT.match(fragment) is not None
+
+
+def merge_math(line: str):
+    # $a$ $b$ and $a$$b$ as one run: the space becomes a control space, the
+    # same glue, and every fragment stays an atom that gets no space around it
+    if "$ $" not in line and "$$" not in line:
+        return line
+    parts = pieces(line)
+    out = []
+    i = 0
+    while i < len(parts):
+        if type(parts[i]) != tuple:
+            out.append(parts[i])
+            i += 1
+            continue
+        run = [parts[i][1]]
+        i += 1
+        while i < len(parts):
+            if type(parts[i]) == tuple:
+                run.append(parts[i][1])
+            elif parts[i] == " " and i + 1 < len(parts) and type(parts[i + 1]) == tuple:
+                run.append(" ")
+            else:
+                break
+            i += 1
+        if len(run) == 1:
+            out.append(f"${run[0]}$")
+            continue
+        out.append("$" + "".join(r"\ " if fragment == " " else fragment if ordinary(fragment)
+                                 else f"{{{fragment}}}" for fragment in run) + "$")
+    return "".join(out)
+
+
+class Compactor:
+    # rewrites rendered lines with fewer math runs, color groups and bytes,
+    # each rewrite typesetting exactly like the original
+    def __init__(self, cmd: MacroList):
+        registry = {mac.full_name: mac for mac in cmd}
+        nullary = [mac for mac in cmd if type(mac) == Command and mac.args == 0]
+        # \cAnd{} \cNot{} as \op{and not}, one color group
+        self.colors: dict[str, tuple[str, str]] = {}
+        for mac in nullary:
+            match = re.fullmatch(r"\\(\w+)\{([^{}]*)\}", mac.body)
+            if match and match[1] in registry and registry[match[1]].args == 1:
+                self.colors[mac.full_name] = (match[1], match[2])
+        if self.colors:
+            names = "|".join(sorted(self.colors, key=len, reverse=True))
+            self.color_run = re.compile(rf"\\({names})\{{\}}(?: \\({names})\{{\}})+")
+        # the {} of \cNull{} is only needed before a letter or a space
+        names = "|".join(sorted((mac.full_name for mac in nullary), key=len, reverse=True))
+        self.empty_argument = re.compile(rf"(\\(?:{names}))\{{\}}(?=[^A-Za-z\s])")
+
+    def merge_colors(self, match: re.Match):
+        groups: list[tuple[str, list[str]]] = []
+        for name in re.findall(r"\\(\w+)\{\}", match[0]):
+            color = self.colors[name][0]
+            if groups and groups[-1][0] == color:
+                groups[-1][1].append(name)
+            else:
+                groups.append((color, [name]))
+        return " ".join(rf"\{names[0]}{{}}" if len(names) == 1 else
+                        rf"\{color}{{{" ".join(self.colors[name][1] for name in names)}}}"
+                        for color, names in groups)
+
+    def line(self, line: str):
+        if self.colors:
+            line = self.color_run.sub(self.merge_colors, line)
+        line = merge_math(line)
+        return self.empty_argument.sub(r"\1", line)
+
+    def __call__(self, text: str):
+        return "".join(self.line(line) for line in text.splitlines(True))
+
+
+class CompactWriter:
+    # compacts what is written to sink a whole line at a time
+    def __init__(self, compactor: Compactor, sink: TextIO):
+        self.compactor = compactor
+        self.sink = sink
+        self.partial = ""
+
+    def write(self, text: str):
+        end = text.rfind("\n")
+        if end == -1:
+            self.partial += text
+            return
+        self.sink.write(self.compactor(self.partial + text[:end + 1]))
+        self.partial = text[end + 1:]
+
+    def flush(self):
+        # the last line, which may not end in a line break
+        if self.partial:
+            self.sink.write(self.compactor.line(self.partial))
+            self.partial = ""
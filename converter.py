@@ -1,7 +1,16 @@
-from parse import convert
 from macro import *
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Iterator
 import argparse
-import pyperclip
+import functools
+import glob
+import io
+import os
+import sys
+import time
+
+# parse (and ast), the render cache, the process pool and the clipboard are
+# imported where they are first needed, so that -p and -o runs start fast
 
 PACKAGES = r"""\usepackage{amsmath}
 \usepackage{xcolor, colortbl}
@@ -51,6 +60,7 @@ DARK_MODE = Theme(FUNC_YELLOW, "444444", "222222",
                   CONTROL_PURPLE, KEYWORD_BLUE, NUMBER_GREEN, CLASS_GREEN, VAR_BLUE, "FFFFFF",  "555555", STRING_ORANGE)
 
 THEMES = (DEFAULT_MODE, LIGHT_MODE, DARK_MODE)
+THEME_NAMES = ("default", "light", "dark")
 
 MACROS = MacroList()
 MACROS.new(Command("comment", r"\textcolor{red}{// #1}", 1))
@@ -97,18 +107,526 @@ MACROS.new(Environment(
     "scope", r"\begin{tabular}{!{\color{laddercolor}\vline}@{\hskip 1em}l}%", r"\end{tabular}%", 0))
 
 
-def indent(str: str, start_scope=0):
-    out = ""
-    scope = start_scope
-    for line in str.splitlines(True):
-        if line.startswith(r"\end"):
-            scope -= 1
-        out += ("\t" * scope) + line
-        if line.startswith(r"\begin"):
-            scope += 1
+def preamble(theme: Theme, macros: MacroList):
+    out = r"\documentclass[letterpaper]{article}""\n\n"
+    out += PACKAGES + "\n\n"
+    out += str(theme) + "\n\n"
+    out += str(macros)
+    # out += ENV_DEF + "\n\n"
+    out += r"\begin{document}""\n"
     return out
 
 
+@functools.cache
+def begin_document(theme: Theme):
+    return preamble(theme, MACROS)
+
+
+def shaken_begin_document(body: str, theme: Theme):
+    # only the macros and colors the body references, directly or through
+    # other macro definitions
+    macros = MACROS.used(body)
+    return preamble(theme.used(str(macros) + body), macros)
+
+
+END_DOCUMENT = r"\end{document}"
+
+
+@functools.cache
+def package_source(theme: Theme):
+    # every macro and theme color as a LaTeX package, versioned by a hash of
+    # its definitions
+    import hashlib
+    body = PACKAGES.replace(r"\usepackage", r"\RequirePackage") + "\n\n"
+    body += str(theme) + "\n\n"
+    body += str(MACROS)
+    version = hashlib.sha256(body.encode()).hexdigest()[:8]
+    name = f"ganapseudo-{THEME_NAMES[THEMES.index(theme)] if theme in THEMES else version}"
+    return name, (r"\NeedsTeXFormat{LaTeX2e}""\n"
+                  rf"\ProvidesPackage{{{name}}}[v{version} CSE214 pseudocode]""\n"
+                  + body + r"\endinput""\n")
+
+
+@functools.cache
+def package_begin_document(theme: Theme):
+    name, _ = package_source(theme)
+    return r"\documentclass[letterpaper]{article}""\n\n" \
+        rf"\usepackage{{{name}}}""\n\n" r"\begin{document}""\n"
+
+
+def write_package(directory: str, theme: Theme):
+    # left untouched when already current, so its mtime only changes with it
+    name, source = package_source(theme)
+    path = os.path.join(directory, name + ".sty")
+    try:
+        with open(path) as f:
+            if f.read() == source:
+                return path
+    except FileNotFoundError:
+        pass
+    # replaced whole, a concurrent LaTeX run never reads half of it
+    with replacing(path) as f:
+        f.write(source)
+    return path
+
+
+@contextmanager
+def replacing(path: str):
+    # writes path whole once the block succeeds, leaving it untouched on an
+    # error. Devices such as /dev/stdout and symlinks are written in place
+    if os.path.exists(path) and (os.path.islink(path) or not os.path.isfile(path)):
+        with open(path, "w") as f:
+            yield f
+        return
+    temporary = path + ".tmp"
+    try:
+        with open(temporary, "w") as f:
+            yield f
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@functools.lru_cache(maxsize=256)
+def referenced_begin_document(summary: str, theme: Theme):
+    # keyed by the references of a body, which most bodies share with others
+    return shaken_begin_document(summary, theme)
+
+
+def document(body: str, theme: Theme, full_prelude=False, package=False):
+    if package:
+        return package_begin_document(theme) + body + END_DOCUMENT
+    if full_prelude:
+        return begin_document(theme) + body + END_DOCUMENT
+    return referenced_begin_document(references([body]), theme) + body + END_DOCUMENT
+
+
+class DocumentBuilder:
+    # standalone documents for many bodies, each distinct prelude rendered once
+    def __init__(self, theme: Theme | int = 0, full_prelude=False, package=False):
+        self.theme = THEMES[theme] if isinstance(theme, int) else theme
+        self.full_prelude = full_prelude
+        self.package = package
+
+    def begin(self, bodies: Iterable[str]):
+        if self.package:
+            return package_begin_document(self.theme)
+        if self.full_prelude:
+            return begin_document(self.theme)
+        return referenced_begin_document(references(bodies), self.theme)
+
+    def document(self, body: str):
+        return self.begin([body]) + body + END_DOCUMENT
+
+    def combined(self, bodies: Iterable[str]):
+        # one document, the bodies sharing its prelude
+        bodies = list(bodies)
+        return self.begin(bodies) + "".join(bodies) + END_DOCUMENT
+
+
+@functools.cache
+def compactor():
+    # compact.Compactor of MACROS, imported only for compact output
+    from compact import Compactor
+    return Compactor(MACROS)
+
+
+@contextmanager
+def compacted(args: argparse.Namespace, sink):
+    # sink, or with --compact a compact.CompactWriter over it
+    if not args.compact:
+        yield sink
+        return
+    from compact import CompactWriter
+    writer = CompactWriter(compactor(), sink)
+    yield writer
+    writer.flush()
+
+
+def convert_source(text: str, filename="<unknown>", indent=True, depth=0, functions: list[str] = None, limits: "Limits" = None, compact=False):
+    # pseudocode of source text, nothing printed, copied or written to disk
+    from parse import new_converter
+    out = new_converter(MACROS, indent=indent, depth=depth,
+                        limits=limits).convert(text, filename, functions)
+    return compactor()(out) if compact else out
+
+
+def convert_tree(tree: "ast.Module", indent=True, depth=0, limits: "Limits" = None, compact=False):
+    from parse import new_converter
+    if limits is not None:
+        # a tree parsed elsewhere skips the checks of parse_module
+        from limits import measure
+        measure(tree, limits)
+    sink = io.StringIO()
+    new_converter(MACROS, indent=indent, depth=depth,
+                  limits=limits).stream_tree(tree, sink)
+    return compactor()(sink.getvalue()) if compact else sink.getvalue()
+
+
+def convert_many(sources: Iterable[str], indent=True, depth=0, jobs=1, return_exceptions=False, limits: "Limits" = None, compact=False) -> Iterator[str | Exception]:
+    # pseudocode of each source in order, lazily on one converter whose memo they
+    # share, or on jobs worker processes (None for one per core) submitted up front
+    if jobs == 1:
+        from parse import new_converter
+        converter = new_converter(MACROS, indent=indent, depth=depth, limits=limits)
+        results = (functools.partial(converter.convert, text) for text in sources)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        from parse import render_chunk
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = [pool.submit(render_chunk, MACROS, indent, depth, text, "<unknown>", limits).result
+                   for text in sources]
+    try:
+        for result in results:
+            try:
+                out = result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                yield e
+                continue
+            yield compactor()(out) if compact else out
+    finally:
+        if jobs != 1:
+            pool.shutdown(cancel_futures=True)
+
+
+def expand_sources(patterns: list[str]):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files += glob.glob(os.path.join(pattern, "**", "*.py"),
+                               recursive=True)
+        elif glob.has_magic(pattern):
+            files += glob.glob(pattern, recursive=True)
+        else:
+            files.append(pattern)
+    return sorted(set(os.path.normpath(f) for f in files))
+
+
+render_cache = None
+
+
+def open_cache(directory: str, size: float):
+    global render_cache
+    if directory and render_cache is None:
+        from cache import RenderCache
+        render_cache = RenderCache(directory, MACROS, int(size * 2**20))
+    return render_cache
+
+
+def convert_file(filename: str, debug: bool, cache_dir: str = None, cache_size=256.0, indent=True, depth=0, functions: list[str] = None, limits: "Limits" = None, compact=False):
+    cache = open_cache(cache_dir, cache_size)
+    before = cache.stats() if cache else (0, 0, 0)
+    try:
+        from parse import convert
+        out, error = convert(filename, debug, MACROS, cache, indent,
+                             depth, functions, limits=limits), None
+        if compact:
+            out = compactor()(out)
+    except Exception as e:
+        out, error = None, f"{type(e).__name__}: {e}"
+    after = cache.stats() if cache else (0, 0, 0)
+    return out, error, tuple(b - a for a, b in zip(before, after))
+
+
+def batch(args):
+    files = expand_sources(args.batch)
+    if not files:
+        print("no source files matched", file=sys.stderr)
+        return 1
+
+    jobs = args.jobs if args.jobs else os.cpu_count()
+    depth = 1 if args.out_dir or args.output else 0
+    options = ([args.debug] * len(files), [args.cache] * len(files),
+               [args.cache_size] * len(files), [not args.no_indent] * len(files),
+               [depth] * len(files), [args.function] * len(files),
+               [limits_from_args(args)] * len(files), [args.compact] * len(files))
+    if jobs == 1 or len(files) == 1:
+        results = list(map(convert_file, files, *options))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+            results = list(pool.map(convert_file, files, *options,
+                                    chunksize=max(1, len(files) // (jobs * 4))))
+
+    failed = 0
+    for filename, (_, error, _) in zip(files, results):
+        if error:
+            failed += 1
+            print(f"{filename}: {error}", file=sys.stderr)
+    converted = [(filename, out)
+                 for filename, (out, _, _) in zip(files, results) if out is not None]
+
+    theme = THEMES[args.theme if args.theme else 0]
+    if args.out_dir:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f))
+                                   for f in files])
+        directories = set()
+        for filename, out in converted:
+            name = os.path.relpath(os.path.abspath(filename), root)
+            path = os.path.join(args.out_dir,
+                                os.path.splitext(name)[0] + ".tex")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with replacing(path) as f:
+                f.write(document(out, theme, args.full_prelude, args.package))
+            directories.add(os.path.dirname(path))
+        if args.package:
+            # next to the documents, where LaTeX run from their directory finds it
+            for directory in directories:
+                write_package(directory, theme)
+    elif args.output:
+        if args.package:
+            write_package(os.path.dirname(args.output) or ".", theme)
+        with replacing(args.output) as f:
+            f.write(DocumentBuilder(theme, args.full_prelude, args.package).begin(
+                out for _, out in converted))
+            for _, out in converted:
+                f.write(out)
+            f.write(END_DOCUMENT)
+    else:
+        for filename, out in converted:
+            print(f"% {filename}")
+            print(out)
+
+    print(f"converted {len(converted)}/{len(files)} files", file=sys.stderr)
+    if args.cache:
+        hits, misses, evictions = (sum(stats) for stats in
+                                   zip(*(stats for _, _, stats in results)))
+        print(f"cache: {hits} hits, {misses} misses, {evictions} evictions",
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+def render_blocks(converter: "Converter", tree: "ast.Module", cache: dict[str, str], functions: list[str] = None):
+    from parse import fingerprint, selected
+    blocks = {}
+    parts = []
+    for node in tree.body:
+        if functions is not None and not (type(node).__name__ == "FunctionDef" and selected(node.name, functions)):
+            continue
+        key = fingerprint(node)
+        if key not in blocks:
+            blocks[key] = cache[key] if key in cache else converter.render(node)
+        parts.append(blocks[key])
+    return parts, blocks
+
+
+def watch(args):
+    theme = THEMES[args.theme if args.theme else 0]
+    from parse import new_converter
+    from sinks import open_sinks
+    limits = limits_from_args(args)
+    converter = new_converter(MACROS, indent=not args.no_indent,
+                              depth=1 if args.output else 0, limits=limits)
+    cache = {}
+    last_mtime = None
+    last_out = None
+    if args.output and os.path.exists(args.output):
+        with open(args.output) as f:
+            last_out = f.read()
+
+    print(f"watching {args.filename}, Ctrl+C to stop", file=sys.stderr)
+    # converts at once, then checks every interval, also while the file is missing
+    delay = 0
+    try:
+        while True:
+            time.sleep(delay)
+            delay = args.interval
+            try:
+                mtime = os.stat(args.filename).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+
+            try:
+                with open(args.filename) as f:
+                    text = f.read()
+            except FileNotFoundError:
+                # deleted after the stat, as editors saving by rename do, so
+                # whatever replaces it is read on the next check
+                last_mtime = None
+                continue
+            try:
+                if limits:
+                    # each change is one conversion, blocks kept from the last
+                    # one are not rendered again and count for nothing
+                    converter.begin()
+                tree = converter.parse_module(text, args.filename)
+                parts, blocks = render_blocks(converter, tree, cache,
+                                              args.function)
+            except Exception as e:
+                print(f"{args.filename}: {type(e).__name__}: {e}",
+                      file=sys.stderr)
+                continue
+            rendered = len(blocks.keys() - cache.keys())
+            cache = blocks
+
+            out = "".join(parts)
+            if args.compact:
+                out = compactor()(out)
+            if args.output:
+                out = document(out, theme, args.full_prelude, args.package)
+            status = "unchanged"
+            if out != last_out:
+                last_out = out
+                status = "updated"
+                if args.output:
+                    if args.package:
+                        write_package(os.path.dirname(args.output) or ".", theme)
+                    with replacing(args.output) as f:
+                        f.write(out)
+                else:
+                    with open_sinks(args.sink) as sink:
+                        sink.write(out)
+            print(f"re-rendered {rendered}/{len(blocks)} blocks, output {status}",
+                  file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
+def stream_single(args, converter: "Converter"):
+    # reads, renders and writes -f a chunk of top-level statements at a time
+    import shutil
+    import tempfile
+    with open(args.filename) as source:
+        if not args.output:
+            # the clipboard only with --sink, it would hold the whole output
+            from sinks import open_sinks
+            with open_sinks(args.sink, clipboard=False) as sink, compacted(args, sink) as out:
+                converter.stream_lines(source, out, args.filename)
+            return
+        theme = THEMES[args.theme if args.theme else 0]
+        if args.package:
+            write_package(os.path.dirname(args.output) or ".", theme)
+        with replacing(args.output) as f:
+            if args.full_prelude or args.package:
+                f.write(package_begin_document(theme) if args.package else begin_document(theme))
+                with compacted(args, f) as out:
+                    converter.stream_lines(source, out, args.filename)
+            else:
+                # the prelude depends on the body, which waits in a temporary file
+                with tempfile.TemporaryFile("w+") as body:
+                    with compacted(args, body) as out:
+                        converter.stream_lines(source, out, args.filename)
+                    body.seek(0)
+                    f.write(DocumentBuilder(theme).begin(
+                        iter(lambda: "".join(body.readlines(2**20)), "")))
+                    body.seek(0)
+                    shutil.copyfileobj(body, f)
+            f.write(END_DOCUMENT)
+
+
+def convert_single(args):
+    from parse import new_converter
+    profile = None
+    options = (args.debug, open_cache(args.cache, args.cache_size),
+               not args.no_indent, 1 if args.output else 0)
+    converter = new_converter(MACROS, *options, limits_from_args(args))
+    if args.profile:
+        from profiling import Profile, ProfilingConverter, TimedWriter
+        profile = Profile()
+        converter = ProfilingConverter(MACROS, profile, *options)
+
+    def phase(name: str):
+        return profile.phase(name) if profile else nullcontext()
+
+    # the profile counts nodes in this process only
+    jobs = (args.jobs or None) if args.parallel and not profile else 1
+
+    if args.stream:
+        with phase("render"):
+            stream_single(args, converter)
+        if profile:
+            print(profile.to_json() if args.profile == "json" else profile,
+                  file=sys.stderr)
+        return
+
+    with phase("read"):
+        with open(args.filename) as f:
+            text = f.read()
+
+    if args.output:
+        theme = THEMES[args.theme if args.theme else 0]
+        if args.package:
+            with phase("write"):
+                write_package(os.path.dirname(args.output) or ".", theme)
+        with replacing(args.output) as f:
+            if args.full_prelude or args.package:
+                # the full prelude is known up front, the body streams after it
+                with phase("write"):
+                    f.write(package_begin_document(theme) if args.package else begin_document(theme))
+                with phase("render"), compacted(args, TimedWriter(f, profile, "write")
+                                                if profile else f) as out:
+                    converter.stream(text, out, args.filename, args.function, jobs)
+                with phase("write"):
+                    f.write(END_DOCUMENT)
+            else:
+                with phase("render"):
+                    out = converter.convert(text, args.filename,
+                                            args.function, jobs)
+                    if args.compact:
+                        out = compactor()(out)
+                with phase("write"):
+                    f.write(document(out, theme))
+    else:
+        from sinks import open_sinks
+        with open_sinks(args.sink) as sink, phase("render"), \
+                compacted(args, TimedWriter(sink, profile, "write") if profile else sink) as out:
+            converter.stream(text, out, args.filename, args.function, jobs)
+
+    if profile:
+        print(profile.to_json() if args.profile == "json" else profile,
+              file=sys.stderr)
+
+
+def list_functions(filename: str):
+    import ast
+    with open(filename) as f:
+        tree = ast.parse(f.read(), filename)
+    for node in tree.body:
+        if type(node) == ast.FunctionDef:
+            print(f"{node.lineno}\t{node.name}({", ".join(arg.arg for arg in node.args.args)})")
+
+
+def sink_spec(spec: str):
+    from sinks import sink_spec
+    return sink_spec(spec)
+
+
+def add_limit_arguments(parser: argparse.ArgumentParser, defaults: "Limits" = None):
+    # limits.Limits, imported only once a limit is set since it imports parse
+    def default(value):
+        return "Unlimited if omitted" if value is None else f"{value} if omitted, 0 for unlimited"
+    source_size, nodes, depth, output_size, seconds = (None,) * 5 if defaults is None else \
+        (defaults.source_size, defaults.nodes, defaults.depth, defaults.output_size, defaults.seconds)
+    parser.add_argument("--max-source-size", type=int, default=source_size, metavar="CHARS",
+                        help=f"Largest source converted. {default(source_size)}")
+    parser.add_argument("--max-nodes", type=int, default=nodes, metavar="N",
+                        help=f"Most AST nodes converted. {default(nodes)}")
+    parser.add_argument("--max-depth", type=int, default=depth, metavar="N",
+                        help=f"Deepest AST nesting converted. {default(depth)}")
+    parser.add_argument("--max-output-size", type=int, default=output_size, metavar="CHARS",
+                        help=f"Largest output written before giving up. {default(output_size)}")
+    parser.add_argument("--time-limit", type=float, default=seconds, metavar="SECONDS",
+                        help=f"Wall clock time one conversion may take. {default(seconds)}")
+
+
+def limits_from_args(args: argparse.Namespace):
+    values = tuple(value or None for value in (args.max_source_size, args.max_nodes, args.max_depth,
+                                                args.max_output_size, args.time_limit))
+    if all(value is None for value in values):
+        return None
+    from limits import Limits
+    return Limits(*values)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--prelude", action="store_true",
@@ -120,41 +638,86 @@ def main():
     parser.add_argument(
         "-o", "--output", help="Writes a new, standalone document with prelude included. Pseudocode only output is printed if omitted")
     parser.add_argument("-f", "--filename", help="File to be converted")
+    parser.add_argument("-b", "--batch", nargs="+", metavar="SOURCE",
+                        help="Files, directories or glob patterns to convert in parallel. Writes one combined document with -o, one document per file with --out-dir, prints otherwise")
+    parser.add_argument("--out-dir",
+                        help="Directory for the per-file standalone documents of --batch")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of worker processes for --batch and --parallel. Number of cores if omitted")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="Keeps running and reconverts the file given by -f whenever it changes, re-rendering only the top-level functions that changed")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="Seconds between checks for changes with --watch. 0.5 if omitted")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="Directory of a persistent cache of rendered functions, reused across runs")
+    parser.add_argument("--cache-size", type=float, default=256.0, metavar="MB",
+                        help="Size cap of --cache in MiB, least recently used entries are evicted past it. 256 if omitted")
+    parser.add_argument("--profile", nargs="?", const="table", choices=("table", "json"),
+                        help="Reports time per phase, per AST node type, per macro and per top-level function on stderr, as a table or as JSON")
+    parser.add_argument("--no-indent", action="store_true",
+                        help="Skips tab indentation of the output, for output only read by machines")
+    parser.add_argument("--full-prelude", action="store_true",
+                        help="Defines every macro and theme color in -o documents. Only the ones the pseudocode uses if omitted")
+    parser.add_argument("--compact", action="store_true",
+                        help="Merges adjacent math runs and same-color keywords of the pseudocode, which typesets the same in fewer bytes and mode switches. "
+                        "One run per token if omitted")
+    parser.add_argument("--package", action="store_true",
+                        help="Writes every macro and theme color once to a ganapseudo-<theme>.sty next to the -o or --out-dir documents, "
+                        "which \\usepackage it, rewriting it only when it changes. Preludes are inlined if omitted")
+    parser.add_argument("--function", action="append", metavar="NAME",
+                        help="Converts only the top-level functions matching NAME, a glob pattern. Repeatable. Every top-level statement if omitted")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Renders the top-level functions of -f on -j worker processes. Files under 64 KiB are rendered serially")
+    parser.add_argument("--stream", action="store_true",
+                        help="Reads and converts -f a chunk of top-level statements at a time, for sources too large to hold in memory. "
+                        "Prints without copying to the clipboard if -o is omitted")
+    parser.add_argument("--sink", action="append", type=sink_spec, metavar="SINK",
+                        help="Where pseudocode printed without -o goes: stdout, clipboard, file:PATH (also a named pipe) "
+                        "or unix:PATH (a listening unix socket). Repeatable. stdout and the clipboard, when there is one, if omitted")
+    add_limit_arguments(parser)
+    parser.add_argument("--list", action="store_true",
+                        help="Lists the top-level functions of -f with their line numbers, without converting them")
     args = parser.parse_args()
+    if args.stream and (args.function or args.parallel or args.watch):
+        parser.error("--stream cannot be combined with --function, --parallel or --watch")
+    if args.profile and limits_from_args(args):
+        # the profiling converter renders without the limits
+        parser.error("--profile cannot be combined with --max-* or --time-limit")
 
-    if args.filename and args.output:
-        theme = THEMES[args.theme if args.theme else 0]
+    try:
+        if args.filename and args.list:
+            list_functions(args.filename)
+        elif args.batch:
+            sys.exit(batch(args))
+        elif args.filename and args.watch:
+            watch(args)
+        elif args.filename and args.output:
+            convert_single(args)
+        else:
+            if (args.prelude):
+                print("% pseudocode packages")
+                print(PACKAGES)
+                print()
+                print("% pseudocode environment definition")
+                # print(ENV_DEF)
+                print()
 
-        out = r"\documentclass[letterpaper]{article}""\n\n"
-        out += PACKAGES + "\n\n"
-        out += str(theme) + "\n\n"
-        out += str(MACROS)
-        # out += ENV_DEF + "\n\n"
-        out += r"\begin{document}""\n"
-        # out += convert(args.filename, args.debug, MACROS) -
-        out += indent(convert(args.filename, args.debug, MACROS), 1)
-        out += r"\end{document}"
-
-        with open(args.output, "w") as f:
-            f.write(out)
-    else:
-        if (args.prelude):
-            print("% pseudocode packages")
-            print(PACKAGES)
-            print()
-            print("% pseudocode environment definition")
-            # print(ENV_DEF)
-            print()
-
-        if args.theme != None:
-            theme = THEMES[args.theme]
-            print(rf"""% pseudocode colors
+            if args.theme != None:
+                theme = THEMES[args.theme]
+                print(rf"""% pseudocode colors
 {str(theme)}
 """)
-        if args.filename:
-            out = indent(convert(args.filename, args.debug, MACROS))
-            pyperclip.copy(out)
-            print(out)
+            if args.filename:
+                convert_single(args)
+    except ValueError as e:
+        from limits import LimitExceeded
+        if not isinstance(e, LimitExceeded):
+            raise
+        print(f"{args.filename}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if render_cache:
+        print(render_cache, file=sys.stderr)
 
 
 if __name__ == "__main__":
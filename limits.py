@@ -0,0 +1,171 @@
+from macro import MacroList
+from parse import Converter
+from typing import Callable, Iterable, TextIO
+import ast
+import math
+import time
+
+
+class Limits:
+    # None turns a limit off. Sizes are in characters, seconds are wall clock
+    def __init__(self, source_size: int | None = 2**20, nodes: int | None = 1_000_000, depth: int | None = 100,
+                 output_size: int | None = 16 * 2**20, seconds: float | None = 10.0):
+        self.source_size = source_size
+        self.nodes = nodes
+        self.depth = depth
+        self.output_size = output_size
+        self.seconds = seconds
+
+
+UNLIMITED = Limits(None, None, None, None, None)
+
+
+class LimitExceeded(ValueError):
+    def __init__(self, limit: str, value: int | float | None, maximum: int | float, lineno: int = None):
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+        self.lineno = lineno
+        super().__init__(f"{limit.replace("_", " ")} {"" if value is None else f"{value} "}"
+                         f"exceeds the limit of {maximum}{"" if lineno is None else f" at line {lineno}"}")
+
+    def __reduce__(self):
+        # pickled back from worker processes with its fields, not just the message
+        return LimitExceeded, (self.limit, self.value, self.maximum, self.lineno)
+
+    def to_dict(self):
+        return {"error": "limit exceeded", "limit": self.limit, "value": self.value,
+                "maximum": self.maximum, "line": self.lineno}
+
+
+# per node type, the fields that can hold child nodes, leaving out names,
+# constants and the shared Load/Store contexts
+CHILD_FIELDS: dict[type, tuple[str, ...]] = {}
+
+
+def child_fields(node_type: type):
+    types = getattr(node_type, "_field_types", {})  # Python 3.13+, otherwise all fields
+    fields = CHILD_FIELDS[node_type] = tuple(
+        name for name in node_type._fields if name != "ctx" and
+        (name not in types or "ast." in str(types[name]) or
+         isinstance(types[name], type) and issubclass(types[name], ast.AST)))
+    return fields
+
+
+def line(node: ast.AST, depth: int, first: int):
+    # parse_module moves only the top-level statements of a chunk starting at
+    # line first to lines of the whole file, nested nodes keep the chunk's
+    lineno = getattr(node, "lineno", None)
+    return lineno if lineno is None or depth <= 1 else lineno + first - 1
+
+
+def measure(tree: ast.AST, limits: Limits, nodes=0, first=1):
+    # node count and nesting depth, in source order, stopping at the first
+    # node past either limit. The left operand of a BinOp keeps its parent's
+    # depth, since operator chains render in a loop rather than a recursion
+    max_nodes = math.inf if limits.nodes is None else limits.nodes
+    max_depth = math.inf if limits.depth is None else limits.depth
+    pending = [(tree, 0)]
+    while pending:
+        node, depth = pending.pop()
+        nodes += 1
+        if nodes > max_nodes:
+            raise LimitExceeded("nodes", nodes, max_nodes, line(node, depth, first))
+        if depth > max_depth:
+            raise LimitExceeded("depth", depth, max_depth, line(node, depth, first))
+        node_type = type(node)
+        if node_type is ast.BinOp:
+            pending.append((node.right, depth + 1))
+            pending.append((node.left, depth))
+            continue
+        depth += 1
+        fields = CHILD_FIELDS.get(node_type)
+        if fields is None:
+            fields = child_fields(node_type)
+        for name in fields:
+            value = getattr(node, name)
+            if type(value) is list:
+                pending += [(child, depth) for child in reversed(value)
+                            if isinstance(child, ast.AST)]
+            elif isinstance(value, ast.AST):
+                pending.append((value, depth))
+    return nodes
+
+
+class LimitedConverter(Converter):
+    # checks the source before parsing it, the tree before rendering it, and
+    # the output and the clock on every write, at least once a rendered line
+    def __init__(self, cmd: MacroList, limits: Limits, debug=False, cache=None, indent=True, depth=0):
+        super().__init__(cmd, debug, cache, indent, depth)
+        self.limits = limits
+        self.begin()
+
+    def begin(self):
+        self.source_size = 0
+        self.nodes = 0
+        self.output_size = 0
+        self.deadline = None if self.limits.seconds is None else \
+            time.perf_counter() + self.limits.seconds
+
+    def check_time(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise LimitExceeded("seconds", None, self.limits.seconds)
+
+    def parse_module(self, text: str, filename="<unknown>", first=1):
+        limits = self.limits
+        if limits.source_size is not None and self.source_size + len(text) > limits.source_size:
+            raise LimitExceeded("source_size", self.source_size + len(text),
+                                limits.source_size)
+        try:
+            tree = super().parse_module(text, filename, first)
+        except (RecursionError, MemoryError):
+            # CPython's own parser gives up on nesting far past any limit
+            raise LimitExceeded("depth", None, limits.depth or 0) from None
+        self.source_size += len(text)
+        self.nodes = measure(tree, limits, self.nodes, first)
+        self.check_time()
+        return tree
+
+    def attach(self, write: Callable[[str], object]):
+        super().attach(write)
+        self.unlimited_write = self.write
+        self.write = self.write_limited
+
+    def write_limited(self, text: str):
+        self.count_output(text)
+        self.unlimited_write(text)
+
+    def count_output(self, text: str):
+        self.output_size += len(text)
+        if self.limits.output_size is not None and self.output_size > self.limits.output_size:
+            raise LimitExceeded("output_size", self.output_size,
+                                self.limits.output_size)
+        self.check_time()
+
+    def stream_node(self, node: ast.stmt):
+        if not self.cache:
+            super().stream_node(node)
+            return
+        # cached text goes straight to the sink. A miss was counted as it
+        # rendered into a string, so every block is counted once, here
+        output_size = self.output_size
+        out = self.cache.render(self, node)
+        self.output_size = output_size
+        self.count_output(out)
+        self.sink_write(out)
+
+    def stream(self, text: str, sink: TextIO, filename="<unknown>", functions: list[str] = None, jobs=1):
+        self.begin()
+        # workers of the parallel path would render outside the limits
+        try:
+            super().stream(text, sink, filename, functions, 1)
+        except RecursionError:
+            raise LimitExceeded("depth", None, self.limits.depth or 0) from None
+
+    def stream_lines(self, lines: Iterable[str], sink: TextIO, filename="<unknown>"):
+        self.begin()
+        try:
+            super().stream_lines(lines, sink, filename)
+        except RecursionError:
+            raise LimitExceeded("depth", None, self.limits.depth or 0) from None
+
@@ -1,35 +1,56 @@
+import re
+import sys
+from typing import Iterable
+
+# a macro is referenced as \name or \begin{name}, a color as {name}
+REFERENCE = re.compile(r"\\(?:begin\{)?([A-Za-z]+)")
+COLOR_REFERENCE = re.compile(r"\{(\w+)\}")
+
+
+def references(texts: Iterable[str]):
+    # the distinct references of texts cut at line breaks, as text that
+    # MacroList.used and Theme.used read like all of texts
+    macros, colors = set(), set()
+    for text in texts:
+        macros.update(REFERENCE.findall(text))
+        colors.update(COLOR_REFERENCE.findall(text))
+    return " ".join([rf"\{name}" for name in sorted(macros)] + [f"{{{name}}}" for name in sorted(colors)])
+
+
 class Command:
+    __slots__ = ("name", "full_name", "body", "args", "template")
+
     def __init__(self, name: str, body: str, args=0, mangle=False):
         self.name = name
         self.full_name = f"c{name.title()}" if mangle else name
         self.body = body
         self.args = args
+        # \name{%s}{%s}..., or the interned \name{} returned by every zero-arg call
+        self.template = sys.intern(rf"\{self.full_name}{"{}" if args == 0 else "{%s}" * args}")
 
     def __call__(self, *args):
-        def wrap(s):
-            return f"{{{s}}}"
         assert len(args) == self.args
-        return rf"\{self.full_name}{"{}" if self.args == 0 else "".join(wrap(s) for s in args)}"
+        return self.template % args if args else self.template
 
     def __str__(self):
         return rf"\newcommand{{\{self.full_name}}}[{self.args}]{{{self.body}}}"
 
 
 class Environment:
+    __slots__ = ("name", "full_name", "begin", "end", "args", "template")
+
     def __init__(self, name: str, begin: str, end: str, args: int):
         self.name = name
+        self.full_name = name
         self.begin = begin
         self.end = end
         self.args = args
+        self.template = rf"\begin{{{name}}}" + "{%s}" * args + \
+            "\n\t%s\n" + rf"\end{{{name}}}"
 
     def __call__(self, *args):
-        def wrap(s):
-            return f"{{{s}}}"
         assert len(args) - 1 == self.args
-        out = rf"\begin{{{self.name}}}{"".join(wrap(arg) for arg in args[:-1])}""\n"
-        out += "\t" + args[-1] + "\n"
-        out += rf"\end{{{self.name}}}"
-        return out
+        return self.template % args
 
     def __str__(self):
         return rf"\newenvironment{{{self.name}}}[{self.args}]" + "{%\n" \
@@ -40,11 +61,44 @@ class Environment:
 
 
 class MacroList:
+    def __init__(self):
+        self.macros: dict[str, Command | Environment] = {}
+
     def new(self, mac: Command | Environment):
+        self.macros[mac.name] = mac
+        # c._name stays a plain instance attribute, the fastest lookup for parse.py
         setattr(self, f"_{mac.name}", mac)
 
+    def __getitem__(self, name: str):
+        return self.macros[name]
+
+    def __contains__(self, name: str):
+        return name in self.macros
+
+    def __iter__(self):
+        return iter(self.macros.values())
+
+    def __len__(self):
+        return len(self.macros)
+
+    def used(self, text: str):
+        # the macros referenced by text, and transitively by their definitions
+        registry = {mac.full_name: mac for mac in self}
+        names = set()
+        pending = [text]
+        while pending:
+            for name in REFERENCE.findall(pending.pop()):
+                if name in registry and name not in names:
+                    names.add(name)
+                    pending.append(str(registry[name]))
+        subset = MacroList()
+        for mac in self:
+            if mac.full_name in names:
+                subset.new(mac)
+        return subset
+
     def __str__(self):
-        return "\n".join(str(v) for v in self.__dict__.values())
+        return "\n".join(str(mac) for mac in self)
 
 
 class Theme:
@@ -54,5 +108,12 @@ class Theme:
     def __init__(self, *colors):
         self.colors = dict(zip(Theme.COLORS, colors))
 
+    def used(self, text: str):
+        names = set(COLOR_REFERENCE.findall(text))
+        subset = Theme()
+        subset.colors = {name: value for name, value in self.colors.items()
+                         if name in names}
+        return subset
+
     def __str__(self):
         return "\n".join(rf"\definecolor{{{name}}}{{HTML}}{{{value}}}" for name, value in self.colors.items())
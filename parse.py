@@ -1,5 +1,11 @@
 import ast
 import builtins
+import io
+import os
+import re
+import sys
+from fnmatch import fnmatchcase
+from typing import Callable, Iterable, Iterator, TextIO
 from macro import MacroList
 
 DATA_STRUCTURE_TYPES = {
@@ -19,9 +25,6 @@ DATA_STRUCTURE_TYPES = {
     "MaxHeap": "max-heap"
 }
 
-c: MacroList = None
-line_count = 0
-
 # SCOPE_START = r"\begin{tabular}{!{\color{laddercolor}\vline}@{\hskip 1em}l}""\n"
 # SCOPE_END = r"\end{tabular}"
 SCOPE_START = r"\begin{scope}""\n"
@@ -29,506 +32,980 @@ SCOPE_END = r"\end{scope}"
 NL = r"\\""\n"
 
 
+# a top-level statement starts at column 0, closing brackets continue one.
+# Matched after the line break, which scans much faster than ^ with re.M
+TOP_LEVEL = re.compile(r"\n(?=[^\s#)\]}])")
+FUNCTION_DEF = re.compile(r"def[ \t]+(\w+)")
+# comments and strings, each lexed whole so that a quote inside one never
+# opens another. Only the multi-line strings among them hide column-0 lines
+STRING = re.compile(r"#[^\n]*|'''(?:[^\\]|\\.)*?'''|" r'"""(?:[^\\]|\\.)*?"""|'
+                    r"'(?:[^\\'\n]|\\.)*'|" r'"(?:[^\\"\n]|\\.)*"', re.S)
+
+MEMO_SIZE = 4096
+# below this, starting a pool costs more than rendering on one core
+PARALLEL_MIN_BYTES = 64 * 1024
+# characters of whole top-level statements parsed at once when streaming
+STREAM_CHUNK_BYTES = 64 * 1024
+# a column-0 line that may start a statement, the keywords continue the one before
+STATEMENT_START = re.compile(r"(?!(?:else|elif|except|finally)\b)[^\s#)\]}]")
+
 ELLIPSIS = r"$\,\dots\,$"
 
+PRECEDENCE = {ast.Pow: 0, ast.Mult: 1, ast.Div: 1,
+              ast.FloorDiv: 1, ast.Mod: 1,  ast.Add: 2, ast.Sub: 2, None: 100}
+
+BIN_OP_SYMBOLS = {
+    ast.Mult: r"$\times$",
+    ast.Div: "$/$",
+    ast.Mod: r"$\%$",
+    ast.Add: "$+$",
+    ast.Sub: "$-$"
+}
+
+COMPARE_SYMBOLS = {
+    ast.Eq: r"$=$",
+    ast.NotEq: r"$\not=$",
+    ast.Lt: r"$<$",
+    ast.LtE: r"$\leq$",
+    ast.Gt: r"$>$",
+    ast.GtE: r"$\geq$"
+}
+
+
+def caps(str: str):
+    return str[0].upper() + str[1:]
+
 
 def function_name_transform(str: str):
-    def caps(str: builtins.str):
-        return str[0].upper() + str[1:]
     return "-".join(caps(word) for word in str.split("_"))
 
 
-def parse_if_or_elif(node: ast.If, keyword: str):
-    # out = f"{c._con(keyword)} {parse(node.test)} {c._con("then")}" + NL
-    out = getattr(c, f"_{keyword}")(parse(node.test)) + NL
-    out += SCOPE_START
-    for if_node in node.body:
-        out += parse(if_node)
-    out += SCOPE_END
-    if len(node.orelse) == 0:
-        return out
+def single(node: ast.AST):
+    return type(node) == ast.Name and len(node.id) == 1
+
+
+def count_lines(body: list[ast.stmt]):
+    count = 0
+    bodies = [body]
+    while bodies:
+        for node in bodies.pop():
+            counter = LINES.get(type(node))
+            if counter is None:
+                count += 1
+                continue
+            rows, nested = counter(node)
+            count += rows
+            bodies.extend(nested)
+    return count
+
+
+def if_lines(node: ast.If):
+    rows = 1
+    bodies = []
+    while True:
+        bodies.append(node.body)
+        if len(node.orelse) == 0:
+            break
+        rows += 1
+        if type(node.orelse[0]) != ast.If:
+            bodies.append(node.orelse)
+            break
+        node = node.orelse[0]
+    return rows, bodies
+
+
+def loop_lines(node: ast.While | ast.For):
+    return 1, [node.body]
+
+
+def fingerprint(node: ast.AST):
+    # ast.dump equivalent for identity checks, without recursing per nesting level
+    parts = []
+    for n in ast.walk(node):
+        parts.append(type(n).__name__)
+        for name, value in ast.iter_fields(n):
+            if isinstance(value, list):
+                parts.append(f"{name}*{len(value)}")
+                parts.extend(repr(v)
+                             for v in value if not isinstance(v, ast.AST))
+            elif isinstance(value, ast.AST):
+                parts.append(name)
+            else:
+                parts.append(f"{name}={value!r}")
+    return "\0".join(parts)
 
-    global line_count
-    line_count += 1
-    out += NL
-
-    if type(node.orelse[0]) == ast.If:
-        out += parse_if_or_elif(node.orelse[0], "elif")
-    else:
-        out += c._else() + NL
-        out += SCOPE_START
-        for else_node in node.orelse:
-            out += f"{parse(else_node)}"
-        out += SCOPE_END
-    return out
 
+def brackets(op_type: type, parent_op_type: type):
+    return op_type != parent_op_type and op_type != ast.FloorDiv and \
+        PRECEDENCE[op_type] >= PRECEDENCE[parent_op_type]
 
-def parse_ternary(node: ast.IfExp):
-    return f"({parse(node.test)}) ? {parse(node.body)} : {parse(node.orelse)}"
-
-
-def parse_assign_array_0():
-    return rf"[{parse_constant(ast.Constant(1))}{ELLIPSIS}{parse_name(ast.Name("n"))}]"
-
-
-def parse_assign_array_1(first: ast.Tuple | ast.Subscript):
-    match type(first):
-        case ast.Tuple:
-            return rf"{parse_assign_array_0()} $\leftarrow$ [{parse(first.elts[0])}{ELLIPSIS}{parse(first.elts[1])}]"
-        case ast.Subscript:
-            return rf"{parse_assign_array_0()} $\leftarrow$ {parse_array_subscript(first)}"
-        case _:
-            raise ValueError(f"invalid argument type {type(first)} for Array")
-
-
-def parse_assign_array_2(first: ast.Tuple, second: ast.Tuple | ast.Subscript):
-    match type(second):
-        case ast.Tuple:
-            return rf"[{parse(first.elts[0])}{ELLIPSIS}{parse(first.elts[1])}]" + r" $\leftarrow$ " + \
-                rf"[{parse(second.elts[0])}{ELLIPSIS}{parse(second.elts[1])}]"
-        case ast.Subscript:
-            return rf"[{parse(first.elts[0])}{ELLIPSIS}{parse(first.elts[1])}]" + r" $\leftarrow$ " + \
-                parse_array_subscript(second)
-        case _:
-            raise ValueError(f"invalid argument type {type(first)} for Array")
-
-
-def parse_array_subscript(node: ast.Subscript):
-    match type(node.slice):
-        case ast.Slice:
-            return rf"{parse_name(node.value)}[{parse(node.slice.lower)}{ELLIPSIS}{parse(node.slice.upper)}]"
-        case _:
-            return rf"{parse_name(node.value)}[{parse(node.slice)}]"
-
-
-def parse_array_type_annotation(args: list[ast.AST]):
-    match len(args):
-        case 0:
-            return parse_assign_array_0()
-        case 1:
-            return rf"[{parse(args[0].elts[0])}{ELLIPSIS}{parse(args[0].elts[1])}]"
-        case _:
-            raise ValueError(
-                "invalid number of arguments passed to Array")
-
-
-def parse_print(node: ast.Constant | ast.JoinedStr):
-    def parse_fstring(node: ast.JoinedStr):
-        def parse_val(node: ast.FormattedValue | ast.Constant):
-            match type(node):
-                case ast.FormattedValue:
-                    parsed = ast.parse(node.value)
-                    return parse(parsed)
-                case ast.Constant:
-                    return node.value
-                case _:
-                    raise ValueError(
-                        f"invalid fstring parameter type {type(node)}")
-        return "".join(parse_val(val) for val in node.values)
 
+def leaf(node: ast.AST):
+    # memo key of a name or literal, None for anything larger
     match type(node):
-        case ast.Constant:
-            # return f"{c._con("print")} {node.value}"
-            return c._print(node.value)
-        case ast.JoinedStr:
-            # return f"{c._con("print")} {parse_fstring(node)}"
-            return c._print(parse_fstring(node))
-        case _:
-            raise ValueError(f"unknown type {type(node)} passed to print")
-
-
-def parse_call(node: ast.Call):
-    out = ""
-    match type(node.func):
         case ast.Name:
-            match node.func.id:
-                case "print":
-                    return parse_print(node.args[0])
-            out += c._func(function_name_transform(node.func.id))
-        case ast.Attribute:
-            out += f"{parse(node.func.value)}." + \
-                c._method(function_name_transform(node.func.attr))
-    out += f"({", ".join(parse(arg) for arg in node.args)})"
-    return out
+            return node.id
+        case ast.Constant:
+            return (type(node.value), node.value)
+    return None
+
+
+class Memo:
+    # rendered LaTeX by structural key, the oldest entry is dropped when full
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        out = self.entries.get(key)
+        if out is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return out
 
+    def put(self, key, out: str):
+        if self.size:
+            if len(self.entries) >= self.size:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = out
+        return out
 
-def parse_while(node: ast.While):
-    out = c._while(parse(node.test)) + NL
-    out += SCOPE_START
-    for if_node in node.body:
-        out += parse(if_node)
-    out += SCOPE_END
+    def stats(self):
+        return self.hits, self.misses, len(self.entries)
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return f"memo: {self.hits} hits, {self.misses} misses ({rate:.1%}), {len(self.entries)}/{self.size} entries"
+
+
+def outside_strings(text: str, boundaries: list[int]):
+    # the sorted line starts of text that are not inside a multi-line string
+    hidden = [found.span() for found in STRING.finditer(text) if "\n" in found[0]]
+    out = []
+    i = 0
+    for boundary in boundaries:
+        while i < len(hidden) and hidden[i][1] <= boundary:
+            i += 1
+        if i == len(hidden) or boundary <= hidden[i][0]:
+            out.append(boundary)
     return out
 
 
-def parse_for(node: ast.For):
-    def parse_normal_for():
-        # out = c._con("for") + rf" {parse(node.target)} $\leftarrow$ "
-        out = ""
-        lower = None
-        upper = None
-        direction = +1
-        to = "to"
-        crement = None
-        args = node.iter.args
-        if len(args) == 1:
-            lower = c._num(1)
-            upper = parse(node.iter.args[0])
+def selected(name: str, patterns: list[str]):
+    return any(fnmatchcase(name, pattern) for pattern in patterns)
+
+
+class FunctionIndex:
+    # spans of the top-level defs, found from column-0 lines without parsing the module
+    def __init__(self, text: str):
+        self.text = text
+        self.spans: list[tuple[str, int, int]] = []
+        starts = [m.end() for m in TOP_LEVEL.finditer(text)]
+        # a column-0 def in a docstring parses on its own, so it is never a span
+        if '"""' in text or "'''" in text or "\\\n" in text:
+            starts = outside_strings(text, starts)
+        self.starts = starts = [0] + starts + [len(text)]
+        decorated = None
+        for start, end in zip(starts, starts[1:]):
+            if text.startswith("@", start):
+                decorated = start if decorated is None else decorated
+                continue
+            match = FUNCTION_DEF.match(text, start)
+            if match:
+                self.spans.append((match[1], start if decorated is None else decorated,
+                                   end))
+            decorated = None
+
+    def select(self, patterns: list[str]):
+        return [span for span in self.spans if selected(span[0], patterns)]
+
+    def chunks(self, count: int):
+        # about count spans of whole top-level statements, never cut after a decorator
+        size = len(self.text) / count
+        spans = []
+        start = 0
+        for previous, boundary in zip(self.starts, self.starts[1:-1]):
+            if boundary - start >= size and not self.text.startswith("@", previous):
+                spans.append((start, boundary))
+                start = boundary
+        spans.append((start, len(self.text)))
+        return spans
+
+    def source(self, start: int, end: int):
+        # padded with the preceding line breaks, so line numbers match the module
+        return "\n" * self.text.count("\n", 0, start) + self.text[start:end]
+
+
+class Converter:
+    def __init__(self, cmd: MacroList, debug=False, cache=None, indent=True, depth=0, memo_size=MEMO_SIZE):
+        self.c = cmd
+        self.debug = debug
+        self.cache = cache
+        # identifiers, literals and small subtrees like n - 1 or A[i] render once
+        self.memo = Memo(memo_size)
+        # tab indentation by environment depth, written as lines are emitted
+        self.indent = indent
+        self.depth = depth
+        self.line_start = True
+        self.sink_write = None
+        self.write = None
+        # pending (action, argument) pairs, run last in first out by emit
+        self.stack = []
+
+    def attach(self, write: Callable[[str], object]):
+        self.sink_write = write
+        self.write = self.write_indented if self.indent else write
+
+    def write_indented(self, text: str):
+        if text.find("\n", 0, len(text) - 1) != -1:
+            for line in text.splitlines(True):
+                self.write_indented(line)
+            return
+        if self.line_start:
+            self.sink_write("\t" * self.depth + text)
         else:
-            lower = parse(node.iter.args[0])
-            upper = parse(node.iter.args[1])
-        if len(args) == 3:
-            value = None
-            match type(args[2]):
-                case ast.UnaryOp:
-                    if type(args[2].op) == ast.USub:
-                        direction = -1
-                    else:
-                        direction = +1
-                    value = args[2].operand
-                case _:
-                    value = args[2]
-            match direction:
-                case -1:
-                    to = "down to"
-                case 1:
-                    to = "to"
-            if value.value != 1:
-                crement = parse(value)
-        cond = rf"{parse(node.target)} $\leftarrow$ {lower}"
-        match to:
-            case "to":
-                out += c._forinc(cond, upper,
-                                 crement) if crement else c._for(cond, upper)
-            case "down to":
-                out += c._fordec(cond, upper,
-                                 crement) if crement else c._fordown(cond, upper)
-        return out
+            self.sink_write(text)
+        self.line_start = text[-1:] == "\n"
+
+    def open(self, line: str):
+        self.write(line)
+        self.depth += 1
+
+    def close(self, line: str):
+        self.depth -= 1
+        self.write(line)
+
+    def parse_scope(self, body: list[ast.stmt]):
+        self.open(SCOPE_START)
+        self.stack.append((self.close, SCOPE_END))
+        self.stack.extend((self.parse_statement, body_node)
+                          for body_node in reversed(body))
+
+    def parse_if_or_elif(self, node: ast.If, keyword="if"):
+        # out = f"{self.c._con(keyword)} {self.parse(node.test)} {self.c._con("then")}" + NL
+        self.write(getattr(self.c, f"_{keyword}")(self.parse(node.test)) + NL)
+        if len(node.orelse) != 0:
+            if type(node.orelse[0]) == ast.If:
+                self.stack.append((self.parse_elif, node.orelse[0]))
+            else:
+                self.stack.append((self.parse_else, node.orelse))
+            self.stack.append((self.write, NL))
+        self.parse_scope(node.body)
 
-    def parse_for_each():
-        return c._con("foreach") + " " + \
-            c._op("child") + rf" {parse(node.target)} " + c._op("of") + \
-            f" {parse(node.iter)} " + c._op("node") + \
-            " " + c._con("do")
-
-    out = ""
-    match type(node.iter):
-        case ast.Call:
-            out += parse_normal_for()
-        case ast.Attribute:
-            out += parse_for_each()
-    out += NL
-    out += SCOPE_START
-    for body_node in node.body:
-        out += parse(body_node)
-    out += SCOPE_END
-    return out
+    def parse_elif(self, node: ast.If):
+        self.parse_if_or_elif(node, "elif")
 
+    def parse_else(self, body: list[ast.stmt]):
+        self.write(self.c._else() + NL)
+        self.parse_scope(body)
 
-def parse_assign(node: ast.Assign):
-    def data_structure_prelude(data_type: str):
-        return f"{c._op(f"Create {"an" if data_type == "Array" else "a"}")} {c._type(DATA_STRUCTURE_TYPES[data_type])} {parse_name(node.targets[0])}"
+    def parse_ternary(self, node: ast.IfExp):
+        return f"({self.parse(node.test)}) ? {self.parse(node.body)} : {self.parse(node.orelse)}"
 
-    def data_structure(data_type: str):
-        out = data_structure_prelude(data_type)
-        args = node.value.args
-        match data_type:
-            case "Array":
-                match len(args):
-                    case 0:
-                        out += parse_assign_array_0()
-                    case 1:
-                        out += parse_assign_array_1(node.value.args[0])
-                    case 2:
-                        out += parse_assign_array_2(node.value.args[0],
-                                                    node.value.args[1])
-                    case _:
-                        raise ValueError(
-                            "invalid number of arguments passed to Array")
-            case "List":
-                out += r" $\leftarrow$ "
-                if len(args) == 0:
-                    out += r"[\;]"
-                if len(args) == 1:
-                    out += parse(args[0])
-            case "Mat":
-                if len(args) != 2:
-                    raise ValueError(
-                        "Mat() requires tuple arguments (1, n), (1, m)")
-                out += f"[{parse(args[0].elts[0])}{ELLIPSIS}{parse(args[0].elts[1])}]" + \
-                    f"[{parse(args[1].elts[0])}{ELLIPSIS}{parse(args[1].elts[1])}]"
+    def parse_assign_array_0(self):
+        out = self.memo.get(("Array",))
+        if out is None:
+            out = self.memo.put(("Array",), self.render_assign_array_0())
         return out
 
-    if (type(node.targets[0]), type(node.value)) == (ast.Tuple, ast.Tuple):
-        assignments = zip(node.targets[0].elts, node.value.elts)
-        return "; ".join(rf"{parse(a)} $\leftarrow$ {parse(b)}" for a, b in assignments)
-
-    if type(node.value) == ast.Call and type(node.value.func) == ast.Name:
-        if (data_type := node.value.func.id) in DATA_STRUCTURE_TYPES.keys():
-            return data_structure(data_type)
-
-    return rf"{parse(node.targets[0])} $\leftarrow$ {parse(node.value)}"
-
-
-def parse_function_args(args: list[ast.arg]):
-    def parse_arg(arg: ast.arg):
-        if arg.annotation == None:
-            return c._var(arg.arg)
-        # if type(arg.annotation) != ast.Call:
-        #     raise ValueError("algorithm arg type annotation must be call")
-        call = arg.annotation
-        if call.func.id != "Array":
-            raise ValueError(
-                "algorithm arg type annotation of call must be Array")
-        return f"{c._var(arg.arg)}{parse_array_type_annotation(call.args)}"
-    return ", ".join(parse_arg(arg) for arg in args)
-
-
-def parse_function_def(node: ast.FunctionDef):
-    global line_count
-    line_count = 0
-
-    out = r"\begin{pseudocode}"f"{{{function_name_transform(node.name)}}}"f"{{{parse_function_args(node.args.args)}}}\n"
-    body = ""
-    for body_node in node.body:
-        body += parse(body_node)
-
-    out += r"\begin{tabular}{@{}r}""\n"
-    out += "".join(rf"{i}\\" for i in range(1, line_count + 1)) + "\n"
-    out += r"\end{tabular}""\n"
-    out += r"\begin{tabular}{@{}l@{}}""\n"
-    out += body
-    out += r"\end{tabular}" + NL
-    out += r"\end{pseudocode}"
-    return out
-
+    def render_assign_array_0(self):
+        return rf"[{self.parse_constant(ast.Constant(1))}{ELLIPSIS}{self.parse_name(ast.Name("n"))}]"
 
-def parse_constant(node: ast.Constant):
-    match node.value:
-        case True:
-            return c._true()
-        case False:
-            return c._false()
-        case None:
-            return c._null()
-        case _:
-            match type(node.value):
-                case builtins.int | builtins.float:
-                    return c._num(node.value)
-                case builtins.str:
-                    return c._str(node.value)
-                case _:
-                    raise ValueError(
-                        f"constant value of {type(node.value)} not recognized")
-
-
-def parse_unary_op(node: ast.UnaryOp):
-    match type(node.op):
-        case ast.Not:
-            if type(node.operand) == ast.BoolOp:
-                return f"{c._not()} ({parse_binary_bool_op(node.operand)})"
-            return f"{c._not()} {parse(node.operand)}"
-        case ast.UAdd:
-            if type(node.operand) == ast.BinOp:
-                return f"$+$({parse_bin_op(node.operand)})"
-            return f"$+${parse(node.operand)}"
-        case ast.USub:
-            if type(node.operand) == ast.BinOp:
-                return f"$-$({parse_bin_op(node.operand)})"
-            return f"$-${parse(node.operand)}"
-        case _:
-            raise ValueError(
-                f"unsupported unary operator of type {type(node.op)}")
-
-
-def parse_binary_bool_op(node: ast.BoolOp, brackets=False):
-    def parse_bool_op(op: ast.And | ast.Or):
-        match type(op):
-            case ast.And:
-                return c._and()
-            case ast.Or:
-                return c._or()
+    def parse_assign_array_1(self, first: ast.Tuple | ast.Subscript):
+        match type(first):
+            case ast.Tuple:
+                return rf"{self.parse_assign_array_0()} $\leftarrow$ [{self.parse(first.elts[0])}{ELLIPSIS}{self.parse(first.elts[1])}]"
+            case ast.Subscript:
+                return rf"{self.parse_assign_array_0()} $\leftarrow$ {self.parse_array_subscript(first)}"
             case _:
-                raise ValueError("unreachable")
+                raise ValueError(f"invalid argument type {type(first)} for Array")
+
+    def parse_assign_array_2(self, first: ast.Tuple, second: ast.Tuple | ast.Subscript):
+        match type(second):
+            case ast.Tuple:
+                return rf"[{self.parse(first.elts[0])}{ELLIPSIS}{self.parse(first.elts[1])}]" + r" $\leftarrow$ " + \
+                    rf"[{self.parse(second.elts[0])}{ELLIPSIS}{self.parse(second.elts[1])}]"
+            case ast.Subscript:
+                return rf"[{self.parse(first.elts[0])}{ELLIPSIS}{self.parse(first.elts[1])}]" + r" $\leftarrow$ " + \
+                    self.parse_array_subscript(second)
+            case _:
+                raise ValueError(f"invalid argument type {type(first)} for Array")
+
+    def parse_array_subscript(self, node: ast.Subscript):
+        key = (ast.Subscript, leaf(node.value), leaf(node.slice))
+        if key[1] is None or key[2] is None:
+            return self.render_array_subscript(node)
+        return self.memoized(key, self.render_array_subscript, node)
+
+    def render_array_subscript(self, node: ast.Subscript):
+        match type(node.slice):
+            case ast.Slice:
+                return rf"{self.parse_name(node.value)}[{self.parse(node.slice.lower)}{ELLIPSIS}{self.parse(node.slice.upper)}]"
+            case _:
+                return rf"{self.parse_name(node.value)}[{self.parse(node.slice)}]"
+
+    def parse_array_type_annotation(self, args: list[ast.AST]):
+        match len(args):
+            case 0:
+                return self.parse_assign_array_0()
+            case 1:
+                return rf"[{self.parse(args[0].elts[0])}{ELLIPSIS}{self.parse(args[0].elts[1])}]"
+            case _:
+                raise ValueError(
+                    "invalid number of arguments passed to Array")
+
+    def parse_print(self, node: ast.Constant | ast.JoinedStr):
+        def parse_fstring(node: ast.JoinedStr):
+            def parse_val(node: ast.FormattedValue | ast.Constant):
+                match type(node):
+                    case ast.FormattedValue:
+                        parsed = ast.parse(node.value)
+                        return self.parse(parsed)
+                    case ast.Constant:
+                        return node.value
+                    case _:
+                        raise ValueError(
+                            f"invalid fstring parameter type {type(node)}")
+            return "".join(parse_val(val) for val in node.values)
 
-    def parse_potential_or_brackets(node: ast.AST):
         match type(node):
-            case ast.BoolOp:
-                return parse_binary_bool_op(node, True)
+            case ast.Constant:
+                # return f"{self.c._con("print")} {node.value}"
+                return self.c._print(node.value)
+            case ast.JoinedStr:
+                # return f"{self.c._con("print")} {parse_fstring(node)}"
+                return self.c._print(parse_fstring(node))
             case _:
-                return parse(node)
-
-    if type(node.op) == ast.And:
-        return f" {parse_bool_op(node.op)} ".join(parse_potential_or_brackets(val) for val in node.values)
+                raise ValueError(f"unknown type {type(node)} passed to print")
 
-    if brackets and type(node.op) == ast.Or:
-        return f"({parse_binary_bool_op(node)})"
+    def parse_call(self, node: ast.Call):
+        out = ""
+        match type(node.func):
+            case ast.Name:
+                match node.func.id:
+                    case "print":
+                        return self.parse_print(node.args[0])
+                out += self.memoized(("func", node.func.id),
+                                     self.render_function_name, node.func.id)
+            case ast.Attribute:
+                out += f"{self.parse(node.func.value)}." + \
+                    self.memoized(("method", node.func.attr),
+                                  self.render_method_name, node.func.attr)
+        out += f"({", ".join(self.parse(arg) for arg in node.args)})"
+        return out
 
-    return f" {parse_bool_op(node.op)} ".join(parse(val) for val in node.values)
+    def render_function_name(self, name: str):
+        return self.c._func(function_name_transform(name))
+
+    def render_method_name(self, name: str):
+        return self.c._method(function_name_transform(name))
+
+    def parse_while(self, node: ast.While):
+        self.write(self.c._while(self.parse(node.test)) + NL)
+        self.parse_scope(node.body)
+
+    def parse_for(self, node: ast.For):
+        def parse_normal_for():
+            # out = self.c._con("for") + rf" {self.parse(node.target)} $\leftarrow$ "
+            out = ""
+            lower = None
+            upper = None
+            direction = +1
+            to = "to"
+            crement = None
+            args = node.iter.args
+            if len(args) == 1:
+                lower = self.c._num(1)
+                upper = self.parse(node.iter.args[0])
+            else:
+                lower = self.parse(node.iter.args[0])
+                upper = self.parse(node.iter.args[1])
+            if len(args) == 3:
+                value = None
+                match type(args[2]):
+                    case ast.UnaryOp:
+                        if type(args[2].op) == ast.USub:
+                            direction = -1
+                        else:
+                            direction = +1
+                        value = args[2].operand
+                    case _:
+                        value = args[2]
+                match direction:
+                    case -1:
+                        to = "down to"
+                    case 1:
+                        to = "to"
+                if value.value != 1:
+                    crement = self.parse(value)
+            cond = rf"{self.parse(node.target)} $\leftarrow$ {lower}"
+            match to:
+                case "to":
+                    out += self.c._forinc(cond, upper,
+                                          crement) if crement else self.c._for(cond, upper)
+                case "down to":
+                    out += self.c._fordec(cond, upper,
+                                          crement) if crement else self.c._fordown(cond, upper)
+            return out
+
+        def parse_for_each():
+            return self.c._con("foreach") + " " + \
+                self.c._op("child") + rf" {self.parse(node.target)} " + self.c._op("of") + \
+                f" {self.parse(node.iter)} " + self.c._op("node") + \
+                " " + self.c._con("do")
 
+        out = ""
+        match type(node.iter):
+            case ast.Call:
+                out += parse_normal_for()
+            case ast.Attribute:
+                out += parse_for_each()
+        self.write(out + NL)
+        self.parse_scope(node.body)
+
+    def parse_assign(self, node: ast.Assign):
+        def data_structure_prelude(data_type: str):
+            return f"{self.c._op(f"Create {"an" if data_type == "Array" else "a"}")} {self.c._type(DATA_STRUCTURE_TYPES[data_type])} {self.parse_name(node.targets[0])}"
+
+        def data_structure(data_type: str):
+            out = data_structure_prelude(data_type)
+            args = node.value.args
+            match data_type:
+                case "Array":
+                    match len(args):
+                        case 0:
+                            out += self.parse_assign_array_0()
+                        case 1:
+                            out += self.parse_assign_array_1(node.value.args[0])
+                        case 2:
+                            out += self.parse_assign_array_2(node.value.args[0],
+                                                        node.value.args[1])
+                        case _:
+                            raise ValueError(
+                                "invalid number of arguments passed to Array")
+                case "List":
+                    out += r" $\leftarrow$ "
+                    if len(args) == 0:
+                        out += r"[\;]"
+                    if len(args) == 1:
+                        out += self.parse(args[0])
+                case "Mat":
+                    if len(args) != 2:
+                        raise ValueError(
+                            "Mat() requires tuple arguments (1, n), (1, m)")
+                    out += f"[{self.parse(args[0].elts[0])}{ELLIPSIS}{self.parse(args[0].elts[1])}]" + \
+                        f"[{self.parse(args[1].elts[0])}{ELLIPSIS}{self.parse(args[1].elts[1])}]"
+            return out
+
+        if (type(node.targets[0]), type(node.value)) == (ast.Tuple, ast.Tuple):
+            assignments = zip(node.targets[0].elts, node.value.elts)
+            return "; ".join(rf"{self.parse(a)} $\leftarrow$ {self.parse(b)}" for a, b in assignments)
+
+        if type(node.value) == ast.Call and type(node.value.func) == ast.Name:
+            if (data_type := node.value.func.id) in DATA_STRUCTURE_TYPES.keys():
+                return data_structure(data_type)
+
+        return rf"{self.parse(node.targets[0])} $\leftarrow$ {self.parse(node.value)}"
+
+    def parse_function_args(self, args: list[ast.arg]):
+        def parse_arg(arg: ast.arg):
+            if arg.annotation == None:
+                return self.c._var(arg.arg)
+            # if type(arg.annotation) != ast.Call:
+            #     raise ValueError("algorithm arg type annotation must be call")
+            call = arg.annotation
+            if call.func.id != "Array":
+                raise ValueError(
+                    "algorithm arg type annotation of call must be Array")
+            return f"{self.c._var(arg.arg)}{self.parse_array_type_annotation(call.args)}"
+        return ", ".join(parse_arg(arg) for arg in args)
+
+    def parse_function_def(self, node: ast.FunctionDef):
+        self.open(r"\begin{pseudocode}"f"{{{function_name_transform(node.name)}}}"f"{{{self.parse_function_args(node.args.args)}}}\n")
+        self.open(r"\begin{tabular}{@{}r}""\n")
+        self.write("".join(rf"{i}\\" for i in range(1, count_lines(node.body) + 1)) + "\n")
+        self.close(r"\end{tabular}""\n")
+        self.open(r"\begin{tabular}{@{}l@{}}""\n")
+        self.stack.append((self.close, r"\end{pseudocode}"))
+        self.stack.append((self.close, r"\end{tabular}" + NL))
+        self.stack.extend((self.parse_statement, body_node)
+                          for body_node in reversed(node.body))
+
+    def parse_constant(self, node: ast.Constant):
+        return self.memoized(leaf(node), self.render_constant, node)
+
+    def render_constant(self, node: ast.Constant):
+        match node.value:
+            case True:
+                return self.c._true()
+            case False:
+                return self.c._false()
+            case None:
+                return self.c._null()
+            case _:
+                match type(node.value):
+                    case builtins.int | builtins.float:
+                        return self.c._num(node.value)
+                    case builtins.str:
+                        return self.c._str(node.value)
+                    case _:
+                        raise ValueError(
+                            f"constant value of {type(node.value)} not recognized")
 
-def parse_bin_op(node: ast.BinOp, parent_op_type: type = None):
-    ORDER = {ast.Pow: 0, ast.Mult: 1, ast.Div: 1,
-             ast.FloorDiv: 1, ast.Mod: 1,  ast.Add: 2, ast.Sub: 2, None: 100}
-    this_type = type(node.op)
+    def parse_unary_op(self, node: ast.UnaryOp):
+        match type(node.op):
+            case ast.Not:
+                if type(node.operand) == ast.BoolOp:
+                    return f"{self.c._not()} ({self.parse_binary_bool_op(node.operand)})"
+                return f"{self.c._not()} {self.parse(node.operand)}"
+            case ast.UAdd:
+                if type(node.operand) == ast.BinOp:
+                    return f"$+$({self.parse_bin_op(node.operand)})"
+                return f"$+${self.parse(node.operand)}"
+            case ast.USub:
+                if type(node.operand) == ast.BinOp:
+                    return f"$-$({self.parse_bin_op(node.operand)})"
+                return f"$-${self.parse(node.operand)}"
+            case _:
+                raise ValueError(
+                    f"unsupported unary operator of type {type(node.op)}")
 
-    def parse_operand(node: ast.AST):
-        nonlocal this_type
-        match type(node):
-            case ast.BinOp:
-                return parse_bin_op(node, this_type)
+    def parse_bool_op(self, op: ast.And | ast.Or):
+        match type(op):
+            case ast.And:
+                return self.c._and()
+            case ast.Or:
+                return self.c._or()
             case _:
-                return parse(node)
-
-    def parse_bin(node: ast.BinOp):
-        def symbol(operator: ast.AST):
-            match type(operator):
-                case ast.Mult:
-                    return r"$\times$"
-                case ast.Div:
-                    return "$/$"
-                case ast.Mod:
-                    return r"$\%$"
-                case ast.Add:
-                    return "$+$"
-                case ast.Sub:
-                    return "$-$"
-                case _:
-                    raise ValueError(f"unreachable {type(operator)}")
+                raise ValueError("unreachable")
 
-        match type(node.op):
+    def parse_potential_or_brackets(self, node: ast.AST):
+        if type(node) == ast.BoolOp:
+            return self.parse_binary_bool_op(node, True)
+        return self.parse(node)
+
+    def parse_binary_bool_op(self, node: ast.BoolOp, brackets=False):
+        if type(node.op) == ast.And:
+            return f" {self.parse_bool_op(node.op)} ".join(self.parse_potential_or_brackets(val) for val in node.values)
+
+        if brackets and type(node.op) == ast.Or:
+            return f"({self.parse_binary_bool_op(node)})"
+
+        return f" {self.parse_bool_op(node.op)} ".join(self.parse(val) for val in node.values)
+
+    def parse_operand(self, node: ast.AST, parent_op_type: type):
+        if type(node) == ast.BinOp:
+            return self.parse_bin_op(node, parent_op_type)
+        return self.parse(node)
+
+    def parse_bin(self, node: ast.BinOp, operand_type: type = None):
+        # leaf operands are never bracketed, so the memo ignores operand_type
+        key = (ast.BinOp, type(node.op), leaf(node.left), leaf(node.right))
+        if key[2] is None or key[3] is None:
+            return self.render_bin(node, operand_type)
+        return self.memoized(key, self.render_bin, node)
+
+    def render_bin(self, node: ast.BinOp, operand_type: type = None):
+        # a + b - c parses as BinOp(BinOp(a, +, b), -, c). Every level of that
+        # left spine only wraps the rendering of its left operand, so the spine
+        # is walked in a loop instead of recursing once per operand
+        prefixes = []
+        suffixes = []
+        while True:
+            out, operand_type = self.render_bin_level(node, operand_type or type(node.op),
+                                                      prefixes, suffixes)
+            if out is not None:
+                return "".join(prefixes) + out + "".join(reversed(suffixes))
+            node = node.left
+
+    def render_bin_level(self, node: ast.BinOp, operand_type: type, prefixes: list[str], suffixes: list[str]):
+        # the leftmost operand's rendering, or None after wrapping node.left's,
+        # with the operator type node.left's own operands are bracketed against:
+        # its own, or operand_type still inside an implicit product like 2nm
+        this_type = type(node.op)
+        match this_type:
             case ast.Pow:
-                return rf"$\text{{{parse_operand(node.left)}}}^\text{{{parse_operand(node.right)}}}$"
+                prefixes.append(r"$\text{")
+                suffixes.append(
+                    rf"}}^\text{{{self.parse_operand(node.right, operand_type)}}}$")
+                return self.left_operand(node, operand_type, prefixes, suffixes), None
             case ast.FloorDiv:
-                return rf"$\lfloor${parse_operand(node.left)} $/$ {parse_operand(node.right)}$\rfloor$"
+                prefixes.append(r"$\lfloor$")
+                suffixes.append(
+                    rf" $/$ {self.parse_operand(node.right, operand_type)}$\rfloor$")
+                return self.left_operand(node, operand_type, prefixes, suffixes), None
             case ast.Mult:
-                def single(node: ast.AST):
-                    return type(node) == ast.Name and len(node.id) == 1
-
                 l, r = type(node.left), type(node.right)
                 match (l, r):
                     case (ast.Constant, ast.Name):
                         if single(node.right):
-                            return f"{parse_constant(node.left)}{parse_name(node.right)}"
+                            return f"{self.parse_constant(node.left)}{self.parse_name(node.right)}", None
                     case (ast.Name, ast.Name):
                         if single(node.left) and single(node.right):
-                            return f"{parse_name(node.left)}{parse_name(node.right)}"
+                            return f"{self.parse_name(node.left)}{self.parse_name(node.right)}", None
                     case (ast.BinOp, ast.Name):
                         if single(node.left.right) and single(node.right):
-                            return f"{parse_bin(node.left)}{parse_name(node.right)}"
+                            # 2nm, the left operand is never bracketed
+                            suffixes.append(self.parse_name(node.right))
+                            return None, operand_type
                     case (ast.Name, ast.BinOp):
                         if single(node.left) and single(node.right.left):
-                            return f"{parse_name(node.left)}{parse_bin(node.right)}"
-        return f"{parse_operand(node.left)} {symbol(node.op)} {parse_operand(node.right)}"
-    parsed = parse_bin(node)
-    if this_type != parent_op_type and \
-            this_type != ast.FloorDiv and \
-            ORDER[this_type] >= ORDER[parent_op_type]:
-        return f"({parsed})"
-    return parsed
+                            return f"{self.parse_name(node.left)}{self.parse_bin(node.right, operand_type)}", None
+        if this_type not in BIN_OP_SYMBOLS:
+            raise ValueError(f"unreachable {this_type}")
+        suffixes.append(
+            f" {BIN_OP_SYMBOLS[this_type]} {self.parse_operand(node.right, operand_type)}")
+        return self.left_operand(node, operand_type, prefixes, suffixes), None
+
+    def left_operand(self, node: ast.BinOp, parent_op_type: type, prefixes: list[str], suffixes: list[str]):
+        # parse_operand(node.left, parent_op_type), leaving a BinOp to the loop
+        if type(node.left) != ast.BinOp:
+            return self.parse(node.left)
+        if brackets(type(node.left.op), parent_op_type):
+            prefixes.append("(")
+            suffixes.append(")")
+        return None
+
+    def parse_bin_op(self, node: ast.BinOp, parent_op_type: type = None):
+        parsed = self.parse_bin(node)
+        if brackets(type(node.op), parent_op_type):
+            return f"({parsed})"
+        return parsed
+
+    def parse_name(self, node: ast.Name):
+        # inlined memoized(), names are the most common node
+        out = self.memo.get(node.id)
+        if out is None:
+            out = self.memo.put(node.id, "" if node.id == "_" else
+                                self.c._var(node.id.replace("_", r"\_")))
+        return out
 
+    def parse_kv_pair(self, node: ast.List):
+        return rf"$\langle${', '.join(self.parse(e) for e in node.elts)}$\rangle$"
 
-def parse_name(node: ast.Name):
-    if node.id == "_":
-        return ""
-    return c._var(node.id.replace("_", r"\_"))
+    def parse_tuple(self, node: ast.Tuple):
+        return f"({", ".join(self.parse(val) for val in node.elts)})"
 
+    def parse_expr(self, node: ast.Expr):
+        return self.parse(node.value)
 
-def parse_kv_pair(node: ast.List):
-    return rf"$\langle${', '.join(parse(e) for e in node.elts)}$\rangle$"
+    def parse_attribute(self, node: ast.Attribute):
+        key = leaf(node.value)
+        if key is None:
+            return self.render_attribute(node)
+        return self.memoized((ast.Attribute, key, node.attr), self.render_attribute, node)
 
+    def render_attribute(self, node: ast.Attribute):
+        return f"{self.parse(node.value)}." + self.c._var(node.attr)
 
-def parse_tuple(node: ast.Tuple):
-    return f"({", ".join(parse(val) for val in node.elts)})"
+    def parse_return(self, node: ast.Return):
+        ret = self.c._return()
+        if node.value:
+            return ret + f" {self.parse(node.value)}"
+        return ret
 
+    def parse_continue(self, node: ast.Continue):
+        return self.c._con("continue")
 
-def parse(node: ast.AST):
-    out = ""
-    match type(node):
-        case ast.Constant:
-            out = parse_constant(node)
-        case ast.Eq:
-            out = r"$=$"
-        case ast.NotEq:
-            out = r"$\not=$"
-        case ast.Lt:
-            out = r"$<$"
-        case ast.LtE:
-            out = r"$\leq$"
-        case ast.Gt:
-            out = r"$>$"
-        case ast.GtE:
-            out = r"$\geq$"
-        case ast.Expr:
-            out = rf"{parse(node.value)}"
-        case ast.BinOp:
-            out = parse_bin_op(node)
-        case ast.BoolOp:
-            out = parse_binary_bool_op(node)
-        case ast.UnaryOp:
-            out = parse_unary_op(node)
-        case ast.Attribute:
-            out = f"{parse(node.value)}." + c._var(node.attr)
-        case ast.Name:
-            out = parse_name(node)
-        case ast.Subscript:
-            out = parse_array_subscript(node)
-        case ast.FunctionDef:
-            out = parse_function_def(node)
-        case ast.Return:
-            ret = c._return()
-            if node.value:
-                out = ret + f" {parse(node.value)}"
-            else:
-                out = ret
-        case ast.Call:
-            out = parse_call(node)
-        case ast.If:
-            out = parse_if_or_elif(node, "if")
-        case ast.IfExp:
-            out = parse_ternary(node)
-        case ast.While:
-            out = parse_while(node)
-        case ast.For:
-            out = parse_for(node)
-        case ast.Continue:
-            out = c._con("continue")
-        case ast.Break:
-            out = c._con("break")
-        case ast.Pass:
-            out = c._con("TODO")
-        case ast.Compare:
-            out = f"{parse(node.left)} {parse(node.ops[0])} {parse(node.comparators[0])}"
-        case ast.Assign:
-            out = parse_assign(node)
-        case ast.AugAssign:
-            out = rf"{parse(node.target)} $\leftarrow$ {parse_bin_op(ast.BinOp(node.target, node.op, node.value))}"
-        case ast.Tuple:
-            out = parse_tuple(node)
-        case ast.List:
-            out = parse_kv_pair(node)
-
-    global line_count
-    if isinstance(node, ast.stmt):
-        if type(node) != ast.FunctionDef:
-            line_count += 1
-        return out + NL
-    return out
+    def parse_break(self, node: ast.Break):
+        return self.c._con("break")
+
+    def parse_pass(self, node: ast.Pass):
+        return self.c._con("TODO")
+
+    def parse_compare_op(self, node: ast.cmpop):
+        return COMPARE_SYMBOLS[type(node)]
+
+    def parse_compare(self, node: ast.Compare):
+        key = (ast.Compare, leaf(node.left), type(node.ops[0]),
+               leaf(node.comparators[0]))
+        if key[1] is None or key[3] is None:
+            return self.render_compare(node)
+        return self.memoized(key, self.render_compare, node)
 
+    def render_compare(self, node: ast.Compare):
+        return f"{self.parse(node.left)} {self.parse(node.ops[0])} {self.parse(node.comparators[0])}"
 
-def convert(filename: str, debug: bool, cmd: MacroList):
-    global c
-    c = cmd
+    def parse_aug_assign(self, node: ast.AugAssign):
+        return rf"{self.parse(node.target)} $\leftarrow$ {self.parse_bin_op(ast.BinOp(node.target, node.op, node.value))}"
 
+    def memoized(self, key, render: Callable[[ast.AST], str], node: ast.AST):
+        out = self.memo.get(key)
+        if out is None:
+            out = self.memo.put(key, render(node))
+        return out
+
+    def parse(self, node: ast.AST):
+        handler = EXPRESSIONS.get(type(node))
+        return handler(self, node) if handler else ""
+
+    def parse_statement(self, node: ast.stmt):
+        # compound statements push their bodies onto the stack above this NL
+        self.stack.append((self.write, NL))
+        handler = STATEMENTS.get(type(node))
+        if handler:
+            handler(self, node)
+        else:
+            self.write(self.parse(node))
+
+    def emit(self, node: ast.stmt):
+        base = len(self.stack)
+        depth, line_start = self.depth, self.line_start
+        try:
+            self.parse_statement(node)
+            while len(self.stack) > base:
+                action, arg = self.stack.pop()
+                action(arg)
+        finally:
+            # a statement that failed part way leaves the converter reusable
+            del self.stack[base:]
+            self.depth, self.line_start = depth, line_start
+
+    def parse_module(self, text: str, filename="<unknown>", first=1):
+        tree = ast.parse(text, filename)
+        # a chunk starting at line first gives its top-level statements lines of the
+        # whole file, nothing reads the lines of nested nodes
+        if first > 1:
+            for node in tree.body:
+                node.lineno += first - 1
+                node.end_lineno += first - 1
+
+        if (self.debug):
+            print(ast.dump(tree, indent=4))
+        return tree
+
+    def stream_node(self, node: ast.stmt):
+        if self.cache:
+            # cached text is already indented for this depth
+            self.sink_write(self.cache.render(self, node))
+        else:
+            self.emit(node)
+            self.write("\n")
+
+    def stream_tree(self, tree: ast.Module, sink: TextIO):
+        self.attach(sink.write)
+        for node in tree.body:
+            self.stream_node(node)
+
+    def stream(self, text: str, sink: TextIO, filename="<unknown>", functions: list[str] = None, jobs=1):
+        if functions is None and jobs != 1 and self.stream_parallel(text, sink, filename, jobs):
+            return
+        if functions is None:
+            self.stream_tree(self.parse_module(text, filename), sink)
+            return
+        self.attach(sink.write)
+        for node in self.select_functions(text, functions, filename):
+            self.stream_node(node)
+
+    def parse_chunks(self, lines: Iterable[str], filename="<unknown>", size=STREAM_CHUNK_BYTES) -> Iterator[ast.Module]:
+        # modules of about size characters of whole top-level statements, read lazily.
+        # A chunk is cut before a column-0 line and kept if it parses on its own, which
+        # a prefix of the file only does when it ends between two statements, never
+        # inside a string, a bracket or a decorated def
+        buffer: list[str] = []
+        first = 1
+        chars = 0
+        limit = size
+        for line in lines:
+            if buffer and chars >= limit and STATEMENT_START.match(line):
+                try:
+                    tree = self.parse_module("".join(buffer), filename, first)
+                except SyntaxError:
+                    # a bad cut or a real error, retried once twice as much is read
+                    limit = chars * 2
+                else:
+                    yield tree
+                    first += len(buffer)
+                    buffer.clear()
+                    chars = 0
+                    limit = size
+            buffer.append(line)
+            chars += len(line)
+        text = "".join(buffer)
+        try:
+            tree = self.parse_module(text, filename, first)
+        except SyntaxError:
+            if first == 1:
+                raise
+            # parsed again from line first, so the error and its message report
+            # lines of the whole file
+            ast.parse("\n" * (first - 1) + text, filename)
+            raise
+        yield tree
+
+    def stream_lines(self, lines: Iterable[str], sink: TextIO, filename="<unknown>"):
+        # parses and renders one chunk of top-level statements at a time, so memory
+        # follows the largest chunk rather than the file
+        self.attach(sink.write)
+        for tree in self.parse_chunks(lines, filename):
+            for node in tree.body:
+                self.stream_node(node)
+
+    def stream_parallel(self, text: str, sink: TextIO, filename: str, jobs: int | None):
+        # renders chunks of top-level statements on a pool, False to fall back to serial
+        if self.debug or self.cache or len(text) < PARALLEL_MIN_BYTES:
+            return False
+        jobs = jobs or os.cpu_count()
+        if jobs < 2:
+            return False
+        index = FunctionIndex(text)
+        spans = index.chunks(jobs * 4)
+        if len(spans) < 2:
+            return False
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        # free-threaded builds render on threads, without pickling
+        executor = ThreadPoolExecutor if not getattr(sys, "_is_gil_enabled", lambda: True)() \
+            else ProcessPoolExecutor
+        count = len(spans)
+        with executor(max_workers=min(jobs, count)) as pool:
+            try:
+                parts = list(pool.map(render_chunk, [self.c] * count, [self.indent] * count,
+                                      [self.depth] * count,
+                                      [index.source(start, end)
+                                       for start, end in spans],
+                                      [filename] * count))
+            except SyntaxError:
+                # a split inside a multi-line string or bracket, or a real error
+                # that serial parsing reports properly
+                return False
+        for part in parts:
+            sink.write(part)
+        return True
+
+    def select_functions(self, text: str, patterns: list[str], filename="<unknown>") -> Iterator[ast.FunctionDef]:
+        # parses only the selected defs, the whole module only if the
+        # column-0 scan was fooled, e.g. by a string in a def cut at column 0
+        index = FunctionIndex(text)
+        count = 0
+        for name, start, end in index.select(patterns):
+            try:
+                body = self.parse_module(index.source(start, end), filename).body
+            except SyntaxError:
+                body = None
+            if not body or len(body) != 1 or type(body[0]) != ast.FunctionDef or body[0].name != name:
+                break
+            count += 1
+            yield body[0]
+        else:
+            return
+        nodes = [node for node in self.parse_module(text, filename).body
+                 if type(node) == ast.FunctionDef and selected(node.name, patterns)]
+        yield from nodes[count:]
+
+    def render_functions(self, text: str, patterns: list[str], filename="<unknown>"):
+        for node in self.select_functions(text, patterns, filename):
+            yield node.name, self.cache.render(self, node) if self.cache else self.render(node)
+
+    def render(self, node: ast.stmt):
+        sink = io.StringIO()
+        write = self.sink_write
+        self.attach(sink.write)
+        try:
+            self.emit(node)
+            self.write("\n")
+        finally:
+            self.attach(write)
+        return sink.getvalue()
+
+    def convert(self, text: str, filename="<unknown>", functions: list[str] = None, jobs=1):
+        sink = io.StringIO()
+        self.stream(text, sink, filename, functions, jobs)
+        return sink.getvalue()
+
+
+EXPRESSIONS: dict[type, Callable[[Converter, ast.AST], str]] = {
+    ast.Constant: Converter.parse_constant,
+    ast.Expr: Converter.parse_expr,
+    ast.BinOp: Converter.parse_bin_op,
+    ast.BoolOp: Converter.parse_binary_bool_op,
+    ast.UnaryOp: Converter.parse_unary_op,
+    ast.Attribute: Converter.parse_attribute,
+    ast.Name: Converter.parse_name,
+    ast.Subscript: Converter.parse_array_subscript,
+    ast.Return: Converter.parse_return,
+    ast.Call: Converter.parse_call,
+    ast.IfExp: Converter.parse_ternary,
+    ast.Continue: Converter.parse_continue,
+    ast.Break: Converter.parse_break,
+    ast.Pass: Converter.parse_pass,
+    ast.Compare: Converter.parse_compare,
+    ast.Assign: Converter.parse_assign,
+    ast.AugAssign: Converter.parse_aug_assign,
+    ast.Tuple: Converter.parse_tuple,
+    ast.List: Converter.parse_kv_pair,
+    **{op: Converter.parse_compare_op for op in COMPARE_SYMBOLS}
+}
+
+STATEMENTS: dict[type, Callable[[Converter, ast.stmt], None]] = {
+    ast.FunctionDef: Converter.parse_function_def,
+    ast.If: Converter.parse_if_or_elif,
+    ast.While: Converter.parse_while,
+    ast.For: Converter.parse_for
+}
+
+# rows a statement takes in its function's numbering and the bodies nested in
+# it, for statements other than one row
+LINES: dict[type, Callable[[ast.stmt], tuple[int, list[list[ast.stmt]]]]] = {
+    # a nested def numbers its own body and the enclosing function's rows run
+    # on around it, where the global counter used to restart at each def
+    ast.FunctionDef: lambda node: (0, []),
+    ast.If: if_lines,
+    ast.While: loop_lines,
+    ast.For: loop_lines
+}
+
+
+def register(node_type: type, handler: Callable[[Converter, ast.AST], str]):
+    EXPRESSIONS[node_type] = handler
+
+
+def register_statement(node_type: type, handler: Callable[[Converter, ast.stmt], None],
+                       lines: Callable[[ast.stmt], tuple[int, list[list[ast.stmt]]]] = None):
+    # lines as in LINES, needed when handler writes other than one row
+    STATEMENTS[node_type] = handler
+    if lines is not None:
+        LINES[node_type] = lines
+
+
+def new_converter(cmd: MacroList, debug=False, cache=None, indent=True, depth=0, limits=None):
+    # a limits.LimitedConverter when given limits.Limits
+    if limits is None:
+        return Converter(cmd, debug, cache, indent, depth)
+    from limits import LimitedConverter
+    return LimitedConverter(cmd, limits, debug, cache, indent, depth)
+
+
+def stream(filename: str, debug: bool, cmd: MacroList, sink: TextIO, cache=None, indent=True, depth=0, functions: list[str] = None, jobs=1, limits=None):
     text = None
     with open(filename) as f:
         text = f.read()
-    tree = ast.parse(text)
+    new_converter(cmd, debug, cache, indent, depth, limits).stream(
+        text, sink, filename, functions, jobs)
 
-    if (debug):
-        print(ast.dump(tree, indent=4))
 
-    out = ""
-    for node in tree.body:
-        out += parse(node) + "\n"
-    return out
+def stream_file(filename: str, debug: bool, cmd: MacroList, sink: TextIO, cache=None, indent=True, depth=0, limits=None):
+    # like stream, reading and converting the file a chunk at a time
+    with open(filename) as f:
+        new_converter(cmd, debug, cache, indent, depth, limits).stream_lines(f, sink, filename)
+
+
+def convert(filename: str, debug: bool, cmd: MacroList, cache=None, indent=True, depth=0, functions: list[str] = None, jobs=1, limits=None):
+    sink = io.StringIO()
+    stream(filename, debug, cmd, sink, cache, indent, depth, functions, jobs, limits)
+    return sink.getvalue()
+
+
+def render_chunk(cmd: MacroList, indent: bool, depth: int, source: str, filename: str, limits=None):
+    # runs on worker pools, those of Converter.stream_parallel and aio.AsyncConverter
+    return new_converter(cmd, False, None, indent, depth, limits).convert(source, filename)
+
+
+def functions(filename: str, cmd: MacroList, patterns=("*",), debug=False, cache=None, indent=True, depth=0):
+    # lazily yields (name, rendered) for the matching top-level defs, in source order
+    with open(filename) as f:
+        text = f.read()
+    yield from Converter(cmd, debug, cache, indent, depth).render_functions(text, patterns, filename)
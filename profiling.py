@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from macro import MacroList
+from parse import Converter
+from typing import TextIO
+import ast
+import json
+import time
+
+
+class Profile:
+    PHASES = ("read", "ast.parse", "render", "write")
+
+    def __init__(self):
+        # exclusive wall time, a nested phase pauses the enclosing one
+        self.phases = dict.fromkeys(Profile.PHASES, 0.0)
+        self.current = None
+        self.started = 0.0
+        # name -> [calls, seconds]. Node seconds are exclusive like the phases':
+        # a statement's body and an expression's operands are timed on their
+        # own. Macro seconds are per call, macros call nothing timed
+        self.nodes = {}
+        self.macros = {}
+        # (name, line, dispatched nodes, seconds) per top-level statement
+        self.functions = []
+        self.memo = None
+
+    @contextmanager
+    def phase(self, name: str):
+        now = time.perf_counter()
+        outer = self.current
+        if outer:
+            self.phases[outer] += now - self.started
+        self.current, self.started = name, now
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                now - self.started
+            self.current, self.started = outer, now
+
+    def dispatched(self):
+        return sum(calls for calls, _ in self.nodes.values())
+
+    def to_json(self):
+        return json.dumps({
+            "phases": self.phases,
+            "nodes": {name: {"calls": calls, "self_seconds": seconds}
+                      for name, (calls, seconds) in self.nodes.items()},
+            "macros": {name: {"calls": calls, "seconds": seconds}
+                       for name, (calls, seconds) in self.macros.items()},
+            "functions": [{"name": name, "line": line, "nodes": nodes, "seconds": seconds}
+                          for name, line, nodes, seconds in self.functions],
+            "memo": dict(zip(("hits", "misses", "entries"), self.memo.stats())) if self.memo else None
+        }, indent=4)
+
+    def __str__(self):
+        def table(title: str, rows: dict[str, list], column: str):
+            out = [f"{title:<24} {'calls':>10} {column:>14}"]
+            for name, (calls, seconds) in sorted(rows.items(), key=lambda r: -r[1][1]):
+                out.append(f"{name:<24} {calls:>10} {seconds * 1000:>14.3f}")
+            return out
+
+        total = sum(self.phases.values())
+        out = [f"{'phase':<24} {'ms':>10} {'share':>14}"]
+        for name, seconds in self.phases.items():
+            share = seconds / total if total else 0
+            out.append(f"{name:<24} {seconds * 1000:>10.3f} {share:>14.1%}")
+        out.append("")
+        out += table("node type", self.nodes, "self ms")
+        out.append("")
+        out += table("macro", self.macros, "ms")
+        out.append("")
+        out.append(f"{'function':<24} {'line':>10} {'nodes':>10} {'ms':>10}")
+        for name, line, nodes, seconds in self.functions:
+            out.append(
+                f"{name:<24} {line:>10} {nodes:>10} {seconds * 1000:>10.3f}")
+        if self.memo:
+            out.append("")
+            out.append(str(self.memo))
+        return "\n".join(out)
+
+
+class TimedWriter:
+    def __init__(self, sink: TextIO, profile: Profile, phase: str):
+        self.sink = sink
+        self.profile = profile
+        self.name = phase
+
+    def write(self, text: str):
+        with self.profile.phase(self.name):
+            return self.sink.write(text)
+
+    def flush(self):
+        with self.profile.phase(self.name):
+            if hasattr(self.sink, "flush"):
+                self.sink.flush()
+
+
+class TimedMacros:
+    def __init__(self, cmd: MacroList, profile: Profile):
+        self.cmd = cmd
+        self.profile = profile
+        self.wrappers = {}
+
+    def __getattr__(self, name: str):
+        if name not in self.wrappers:
+            macro = self.cmd[name[1:]]
+            stats = self.profile.macros.setdefault(name[1:], [0, 0.0])
+
+            def timed(*args):
+                start = time.perf_counter()
+                try:
+                    return macro(*args)
+                finally:
+                    stats[0] += 1
+                    stats[1] += time.perf_counter() - start
+            self.wrappers[name] = timed
+        return self.wrappers[name]
+
+
+class ProfilingConverter(Converter):
+    def __init__(self, cmd: MacroList, profile: Profile, debug=False, cache=None, indent=True, depth=0):
+        super().__init__(TimedMacros(cmd, profile), debug, cache, indent, depth)
+        self.profile = profile
+        # stats of the node being timed, paused while a nested node is
+        self.current = None
+        self.started = 0.0
+        profile.memo = self.memo
+
+    def timed(self, handler, node: ast.AST):
+        stats = self.profile.nodes.setdefault(type(node).__name__, [0, 0.0])
+        stats[0] += 1
+        now = time.perf_counter()
+        outer = self.current
+        if outer:
+            outer[1] += now - self.started
+        self.current, self.started = stats, now
+        try:
+            return handler(node)
+        finally:
+            now = time.perf_counter()
+            stats[1] += now - self.started
+            self.current, self.started = outer, now
+
+    def parse(self, node: ast.AST):
+        # a simple statement reaches parse from parse_statement, which counted it
+        if isinstance(node, ast.stmt):
+            return super().parse(node)
+        return self.timed(super().parse, node)
+
+    def parse_statement(self, node: ast.stmt):
+        return self.timed(super().parse_statement, node)
+
+    def parse_module(self, text: str, filename="<unknown>", first=1):
+        with self.profile.phase("ast.parse"):
+            return super().parse_module(text, filename, first)
+
+    def stream_node(self, node: ast.stmt):
+        name = getattr(node, "name", type(node).__name__)
+        nodes = self.profile.dispatched()
+        start = time.perf_counter()
+        super().stream_node(node)
+        self.profile.functions.append((name, node.lineno, self.profile.dispatched() - nodes,
+                                       time.perf_counter() - start))
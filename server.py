@@ -0,0 +1,244 @@
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlsplit
+from collections import deque
+from limits import LimitExceeded, Limits
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+
+def ignore_interrupts():
+    # Ctrl+C reaches the whole process group, the parent shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def render(source: str, theme: int | None, document: bool, indent=True, full_prelude=False, limits: Limits = None):
+    # runs in the worker processes, which keep parse and MACROS imported
+    from converter import MACROS, THEMES, document as standalone
+    from parse import new_converter
+    out = new_converter(MACROS, indent=indent, depth=1 if document else 0,
+                        limits=limits).convert(source)
+    if document:
+        return standalone(out, THEMES[theme if theme else 0], full_prelude)
+    return out
+
+
+class Stats:
+    def __init__(self, window=1024):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds: float, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.latencies.append(seconds)
+
+    def percentile(self, latencies: list[float], p: float):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    def to_json(self, workers: int, capacity: int):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return json.dumps({
+                "status": "ok",
+                "uptime": time.time() - self.started,
+                "workers": workers,
+                "capacity": capacity,
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - workers),
+                "latency_ms": {f"p{int(p * 100)}": self.percentile(latencies, p)
+                               for p in (0.5, 0.9, 0.99)}
+            }, indent=4)
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "ConvertServer"
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def respond(self, status: int, body: str, content_type="text/plain; charset=utf-8"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        match urlsplit(self.path).path:
+            case "/health" | "/stats":
+                self.respond(200, self.server.stats.to_json(self.server.workers, self.server.capacity),
+                             "application/json")
+            case _:
+                self.respond(404, "not found\n")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/convert":
+            self.respond(404, "not found\n")
+            return
+        query = parse_qs(url.query)
+        if "Content-Length" not in self.headers:
+            self.close_connection = True
+            self.respond(411, "Content-Length required\n")
+            return
+        try:
+            theme = int(query["theme"][0]) if "theme" in query else None
+            document = query.get("document", ["0"])[0] not in ("0", "false")
+            indent = query.get("indent", ["1"])[0] not in ("0", "false")
+            full_prelude = query.get("prelude", ["used"])[0] == "full"
+            length = int(self.headers["Content-Length"])
+            if length < 0:
+                raise ValueError(f"negative Content-Length {length}")
+        except ValueError as e:
+            self.close_connection = True
+            self.respond(400, f"{type(e).__name__}: {e}\n")
+            return
+        limits = self.server.limits
+        # UTF-8 takes at most 4 bytes a character, the workers check the
+        # exact size of anything shorter
+        if limits and limits.source_size is not None and length > 4 * limits.source_size:
+            self.close_connection = True
+            self.respond(413, json.dumps(LimitExceeded("source_size", None, limits.source_size).to_dict()) + "\n",
+                         "application/json")
+            return
+        try:
+            source = self.rfile.read(length).decode()
+        except UnicodeDecodeError as e:
+            self.respond(400, f"{type(e).__name__}: {e}\n")
+            return
+        if theme is not None and not 0 <= theme < 3:
+            self.respond(400, f"unknown theme {theme}\n")
+            return
+
+        status, body = self.server.convert(source, theme, document, indent,
+                                           full_prelude)
+        self.respond(status, body, "application/json" if status ==
+                     422 else "text/plain; charset=utf-8")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ConvertServer:
+    def __init__(self, workers: int, queue: int, verbose=False, limits: Limits = None):
+        self.workers = workers
+        self.limits = limits
+        self.capacity = workers + queue
+        self.verbose = verbose
+        self.stats = Stats()
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=ignore_interrupts)
+        # import parse and build the prelude in every worker up front
+        list(self.pool.map(render, ["_\n"] * workers,
+             [None] * workers, [True] * workers))
+
+    def convert(self, source: str, theme: int | None, document: bool, indent: bool, full_prelude: bool):
+        if not self.slots.acquire(blocking=False):
+            with self.stats.lock:
+                self.stats.rejected += 1
+            return 503, "server busy, retry later\n"
+        start = time.perf_counter()
+        with self.stats.lock:
+            self.stats.in_flight += 1
+        try:
+            try:
+                out = self.pool.submit(render, source, theme, document,
+                                       indent, full_prelude, self.limits).result()
+            except LimitExceeded as e:
+                self.stats.record(time.perf_counter() - start, True)
+                return 422, json.dumps(e.to_dict()) + "\n"
+            except Exception as e:
+                self.stats.record(time.perf_counter() - start, True)
+                return 400, f"{type(e).__name__}: {e}\n"
+            self.stats.record(time.perf_counter() - start)
+            return 200, out
+        finally:
+            with self.stats.lock:
+                self.stats.in_flight -= 1
+            self.slots.release()
+
+
+class ThreadingHTTPConvertServer(ThreadingMixIn, HTTPServer, ConvertServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers: int, queue: int, verbose=False, limits: Limits = None):
+        ConvertServer.__init__(self, workers, queue, verbose, limits)
+        HTTPServer.__init__(self, address, Handler)
+
+
+class ThreadingUnixConvertServer(ThreadingMixIn, UnixStreamServer, ConvertServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, workers: int, queue: int, verbose=False, limits: Limits = None):
+        ConvertServer.__init__(self, workers, queue, verbose, limits)
+        UnixStreamServer.__init__(self, path, Handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves conversions over HTTP, keeping the converter warm between requests. "
+        "POST source text to /convert[?theme=N&document=1&prelude=full&indent=0], GET /health for statistics")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Address to listen on. 127.0.0.1 if omitted")
+    parser.add_argument("--port", type=int, default=8214,
+                        help="Port to listen on. 8214 if omitted")
+    parser.add_argument("-s", "--socket",
+                        help="Listens on this unix domain socket instead of TCP")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes. Number of cores if omitted")
+    parser.add_argument("-q", "--queue", type=int, default=64,
+                        help="Requests allowed to wait for a worker before new ones are rejected with 503. 64 if omitted")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Logs every request")
+    # submissions are untrusted, so the limits are on unless turned off
+    from converter import add_limit_arguments, limits_from_args
+    add_limit_arguments(parser, Limits())
+    args = parser.parse_args()
+    limits = limits_from_args(args)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixConvertServer(args.socket, args.workers,
+                                            args.queue, args.verbose, limits)
+        print(f"listening on {args.socket}", file=sys.stderr)
+    else:
+        server = ThreadingHTTPConvertServer((args.host, args.port), args.workers,
+                                            args.queue, args.verbose, limits)
+        print(f"listening on http://{args.host}:{server.server_address[1]}",
+              file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown(cancel_futures=True)
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
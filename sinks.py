@@ -0,0 +1,166 @@
+import os
+import socket
+import sys
+import threading
+
+# writes reach the sinks joined into chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+KINDS = ("stdout", "clipboard", "file", "unix")
+
+
+def sink_spec(spec: str):
+    # argparse type of --sink: stdout, clipboard, file:PATH or unix:PATH
+    kind, _, path = spec.partition(":")
+    if kind not in KINDS or bool(path) != (kind in ("file", "unix")):
+        raise ValueError(spec)
+    return kind, path
+
+
+def clipboard_available():
+    # without a display pyperclip can only fail, after trying every helper it knows
+    if sys.platform.startswith("linux") and "microsoft" not in os.uname().release.lower() and \
+            not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        return False
+    try:
+        import pyperclip
+    except ImportError:
+        return False
+    return True
+
+
+class StdoutSink:
+    def write(self, text: str):
+        sys.stdout.write(text)
+
+    def close(self):
+        # the line break print used to end the output with
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    def discard(self):
+        # what was written stays, without the line break of a finished output
+        sys.stdout.flush()
+
+
+class ClipboardSink:
+    # the latest copy, which waits for the one before so they land in order
+    pending: threading.Thread = None
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+    def copy(self, text: str, previous: threading.Thread | None):
+        import pyperclip
+        if previous:
+            previous.join()
+        try:
+            pyperclip.copy(text)
+        except pyperclip.PyperclipException as e:
+            print(f"clipboard: {e}", file=sys.stderr)
+
+    def close(self):
+        # the helper pyperclip spawns is slow, the process only waits for it on exit
+        thread = threading.Thread(target=self.copy, name="clipboard",
+                                  args=("".join(self.parts), ClipboardSink.pending))
+        ClipboardSink.pending = thread
+        thread.start()
+
+    def discard(self):
+        self.parts = []
+
+
+class FileSink:
+    # also a named pipe, which blocks until its reader opens it
+    def __init__(self, path: str):
+        self.file = open(path, "w")
+
+    def write(self, text: str):
+        self.file.write(text)
+
+    def close(self):
+        self.file.close()
+
+    discard = close
+
+
+class SocketSink:
+    def __init__(self, path: str):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("w", encoding="utf-8")
+
+    def write(self, text: str):
+        self.file.write(text)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    discard = close
+
+
+class Tee:
+    # forwards writes to every sink in chunks, instead of each small write
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+        self.parts = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        chunk = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        for sink in self.sinks:
+            sink.write(chunk)
+
+    def close(self):
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+            return
+        # what was written stays written, a failed conversion is not copied
+        try:
+            self.flush()
+        finally:
+            for sink in self.sinks:
+                sink.discard()
+
+
+def open_sinks(specs: list[tuple[str, str]] = None, clipboard=True):
+    # the sinks of --sink, or stdout and the clipboard when there is one
+    if specs is None:
+        specs = [("stdout", "")]
+        if clipboard and clipboard_available():
+            specs.append(("clipboard", ""))
+    sinks = []
+    for kind, path in specs:
+        match kind:
+            case "stdout":
+                sinks.append(StdoutSink())
+            case "clipboard":
+                if clipboard_available():
+                    sinks.append(ClipboardSink())
+                else:
+                    print("no clipboard available, output not copied",
+                          file=sys.stderr)
+            case "file":
+                sinks.append(FileSink(path))
+            case "unix":
+                sinks.append(SocketSink(path))
+    return Tee(sinks)